@@ -0,0 +1,48 @@
+"""Micro-benchmark of token verification in ``token_required``.
+
+Compares a protected call with the verified token cache disabled (every call
+runs ``jwt.decode``) and enabled (repeated calls are served from the cache).
+
+    python benchmarks/token_required.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import jwt
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from library_app import create_app  # noqa: E402
+from library_app.utils import token_required  # noqa: E402
+
+NUMBER = 20000
+
+
+@token_required
+def protected_view(user_id: int):
+    return user_id
+
+
+def benchmark(token_cache_size: int) -> float:
+    app = create_app('testing')
+    app.config['TOKEN_CACHE_MAX_SIZE'] = token_cache_size
+    token = jwt.encode(
+        {'user_id': 1, 'exp': datetime.utcnow() + timedelta(minutes=30)},
+        app.config['SECRET_KEY']
+    )
+    with app.test_request_context(headers={'Authorization': f'Bearer {token}'}):
+        protected_view()
+        seconds = timeit.timeit(protected_view, number=NUMBER)
+    return seconds / NUMBER * 1_000_000
+
+
+if __name__ == '__main__':
+    without_cache = benchmark(0)
+    with_cache = benchmark(1024)
+    print(f'jwt.decode on every call: {without_cache:.2f} us per call')
+    print(f'verified token cache:     {with_cache:.2f} us per call')
+    print(f'saved per request:        {without_cache - with_cache:.2f} us ({without_cache / with_cache:.1f}x)')
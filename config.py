@@ -13,7 +13,49 @@ class Config:
     SQLALCHEMY_DATABASE_URI = ''
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     PER_PAGE = 5
+    COUNT_ESTIMATE_TIMEOUT = 60
+    COUNT_ESTIMATE_MAX_SIZE = 256
+    EXPORT_BATCH_SIZE = 1000
+    RESULT_CACHE_TYPE = os.environ.get('RESULT_CACHE_TYPE', 'memory')
+    RESULT_CACHE_MAX_SIZE = 1024
+    RESULT_CACHE_REDIS_URL = os.environ.get('RESULT_CACHE_REDIS_URL')
+    RESULT_CACHE_TIMEOUT = 3600
+    ENTITY_CACHE_MAX_SIZE = 4096
+    ENTITY_CACHE_TIMEOUT = 300
+    ENTITY_CACHE_WARM_IDS = {}
+    CHANGES_PER_PAGE = 100
+    CHANGES_MAX_PER_PAGE = 1000
+    CHANGES_SETTLE_SECONDS = 5
     JWT_EXPIRED_MINUTES = 30
+    TOKEN_CACHE_MAX_SIZE = 1024
+    REFRESH_TOKEN_EXPIRED_DAYS = 30
+    # how long other workers may accept access tokens after a password or user data change
+    TOKEN_VERSION_CACHE_TIMEOUT = 5
+    REVOCATION_BLOOM_SIZE = 2 ** 20
+    REVOCATION_BLOOM_HASHES = 7
+    REVOCATION_REFRESH_SECONDS = 5
+    # how late a revocation may commit after its revoked_at and still be picked up by other workers
+    REVOCATION_SETTLE_SECONDS = 5
+    REVOCATION_PRUNE_SECONDS = 3600
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256'
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS') or 260000)
+    PASSWORD_HASH_POOL_SIZE = int(os.environ.get('PASSWORD_HASH_POOL_SIZE') or 0)
+    PASSWORD_HASH_TIMEOUT = 10
+    PASSWORD_HASH_MAX_CONCURRENT = int(os.environ.get('PASSWORD_HASH_MAX_CONCURRENT') or os.cpu_count() or 1)
+    PASSWORD_HASH_WAIT_SECONDS = 0.5
+    AUTH_RATE_LIMIT_TYPE = os.environ.get('AUTH_RATE_LIMIT_TYPE', 'memory')
+    AUTH_RATE_LIMIT_REDIS_URL = os.environ.get('AUTH_RATE_LIMIT_REDIS_URL')
+    AUTH_RATE_LIMIT_MAX_KEYS = 10000
+    # (burst, seconds to refill the whole burst)
+    AUTH_RATE_LIMIT_PER_IP = (30, 60)
+    AUTH_RATE_LIMIT_PER_USERNAME = (5, 60)
+    # 'database' (indexed queries), 'memory' (in-process prefix index) or 'auto' (database on PostgreSQL)
+    AUTHOR_SUGGEST_SOURCE = os.environ.get('AUTHOR_SUGGEST_SOURCE', 'auto')
+    AUTHOR_SUGGEST_LIMIT = 10
+    AUTHOR_SUGGEST_MAX_LIMIT = 50
+    # statements slower than the threshold are logged with their EXPLAIN plan, None disables it
+    SLOW_QUERY_THRESHOLD_MS = 200
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', str(base_dir / 'slow_queries.jsonl'))
     SWAGGER = {
         'title': 'Library API',
         'version': 1
@@ -29,6 +71,9 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = f'sqlite:////{DB_FILE_PATH}'
     DEBUG = True
     TESTING = True
+    CHANGES_SETTLE_SECONDS = 0
+    PASSWORD_HASH_ITERATIONS = 1000
+    SLOW_QUERY_THRESHOLD_MS = None
 
 
 config = {
@@ -1,11 +1,27 @@
+import sqlite3
+
 from flask import Flask
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from config import config
+from library_app.cache import ResultCache, EntityCache
 
 db = SQLAlchemy()
 migrate = Migrate()
+result_cache = ResultCache()
+entity_cache = EntityCache()
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys (and ON DELETE CASCADE) unless enabled per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 
 def create_app(config_name: str = 'development'):
@@ -14,17 +30,25 @@ def create_app(config_name: str = 'development'):
 
     db.init_app(app)
     migrate.init_app(app, db)
+    result_cache.init_app(app)
+    entity_cache.init_app(app)
+
+    from library_app.models import Author, Book
+    from library_app.query_spec import compile_query_specs
+    compile_query_specs(Author, Book)
 
     from library_app.authors import authors_bp
     from library_app.errors import errors_pb
     from library_app.commands import db_manage_bp
     from library_app.books import books_bp
     from library_app.auth import auth_bp
+    from library_app.changes import changes_bp
 
     app.register_blueprint(errors_pb)
     app.register_blueprint(db_manage_bp)
     app.register_blueprint(authors_bp, url_prefix='/api/v1')
     app.register_blueprint(books_bp, url_prefix='/api/v1')
     app.register_blueprint(auth_bp, url_prefix='/api/v1/auth')
+    app.register_blueprint(changes_bp, url_prefix='/api/v1')
 
     return app
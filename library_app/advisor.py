@@ -0,0 +1,139 @@
+import json
+import time
+import warnings
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from typing import Iterable, List, Tuple
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import String, Text, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SAWarning
+
+_log_lock = Lock()
+
+
+def note_query_shape(table: str, filters: Iterable[Tuple[str, str]] = (), sort: Iterable[str] = ()) -> None:
+    """Remember the columns the current request filters (with operators) and sorts on."""
+    if not has_request_context():
+        return
+    shape = g.setdefault('query_shape', {'table': table, 'filters': [], 'sort': []})
+    shape['filters'].extend([column, operator] for column, operator in filters)
+    shape['sort'].extend(sort)
+
+
+def _explain(dbapi_connection, dialect_name: str, statement: str, parameters) -> List[str]:
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect_name == 'sqlite' else 'EXPLAIN '
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [str(row[-1]) for row in cursor.fetchall()]
+    except Exception as error:
+        return [f'EXPLAIN failed: {error}']
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started_at'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_slow_query(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - conn.info.pop('query_started_at', time.perf_counter())) * 1000
+    if executemany or not has_request_context() or 'query_shape' not in g:
+        return
+    threshold_ms = current_app.config.get('SLOW_QUERY_THRESHOLD_MS')
+    log_path = current_app.config.get('SLOW_QUERY_LOG')
+    shape = g.query_shape
+    if threshold_ms is None or not log_path or duration_ms < threshold_ms \
+            or not statement.lstrip().upper().startswith('SELECT') or shape['table'] not in statement:
+        return
+
+    entry = {
+        'recorded_at': datetime.utcnow().isoformat(),
+        'endpoint': request.endpoint,
+        'table': shape['table'],
+        'filters': shape['filters'],
+        'sort': shape['sort'],
+        'duration_ms': round(duration_ms, 3),
+        'statement': statement,
+        'plan': _explain(conn.connection, conn.dialect.name, statement, parameters)
+    }
+    with _log_lock, open(log_path, 'a') as log_file:
+        log_file.write(json.dumps(entry) + '\n')
+
+
+def read_slow_queries(log_path) -> List[dict]:
+    try:
+        with open(log_path) as log_file:
+            return [json.loads(line) for line in log_file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _get_index_columns(engine, table: str) -> List[List[str]]:
+    inspector = inspect(engine)
+    with warnings.catch_warnings():
+        # expression indexes are not reflected, and never cover the suggested column lists
+        warnings.simplefilter('ignore', SAWarning)
+        indexes = [index['column_names'] for index in inspector.get_indexes(table)]
+        indexes += [constraint['column_names'] for constraint in inspector.get_unique_constraints(table)]
+    indexes.append(inspector.get_pk_constraint(table)['constrained_columns'])
+    return [columns for columns in indexes if columns and None not in columns]
+
+
+def _get_unbounded_text_columns(engine, table: str) -> List[str]:
+    return [
+        column['name'] for column in inspect(engine).get_columns(table)
+        if isinstance(column['type'], String) and (isinstance(column['type'], Text) or column['type'].length is None)
+    ]
+
+
+def get_index_recommendations(engine, entries: List[dict]) -> List[dict]:
+    """Group slow queries by table, filters and sort, and suggest an index for each group.
+
+    The suggested index lists the equality filter columns, then the range
+    filter columns, then the sort columns. Unbounded text columns are left
+    out (``excluded``), as B-tree entries are limited in size (about 2.7 KB
+    on PostgreSQL). No index is suggested when an existing index already
+    starts with its first column.
+    """
+    groups = OrderedDict()
+    for entry in entries:
+        key = (entry['table'], tuple(map(tuple, entry['filters'])), tuple(entry['sort']))
+        groups.setdefault(key, []).append(entry)
+
+    index_columns = {}
+    text_columns = {}
+    recommendations = []
+    for (table, filters, sort), group in groups.items():
+        columns = [column for column, operator in filters if operator == '==']
+        columns += [column for column, operator in filters if operator != '==']
+        columns += [column.lstrip('-') for column in sort]
+        columns = list(OrderedDict.fromkeys(columns))
+
+        if table not in index_columns:
+            index_columns[table] = _get_index_columns(engine, table)
+            text_columns[table] = _get_unbounded_text_columns(engine, table)
+        excluded = [column for column in columns if column in text_columns[table]]
+        columns = [column for column in columns if column not in excluded]
+        covering = [existing for existing in index_columns[table] if columns and existing[0] == columns[0]]
+
+        slowest = max(group, key=lambda entry: entry['duration_ms'])
+        recommendations.append({
+            'table': table,
+            'filters': [f'{column}[{operator}]' for column, operator in filters],
+            'sort': list(sort),
+            'count': len(group),
+            'max_duration_ms': slowest['duration_ms'],
+            'plan': slowest['plan'],
+            'covered_by': covering[0] if covering else None,
+            'excluded': excluded,
+            'index': f'CREATE INDEX ix_{table}_{"_".join(columns)} ON {table} ({", ".join(columns)})'
+            if columns and not covering else None
+        })
+    recommendations.sort(key=lambda recommendation: recommendation['max_duration_ms'], reverse=True)
+    return recommendations
@@ -1,37 +1,43 @@
-from flask import jsonify, abort
+from datetime import datetime
+
+from flask import jsonify, abort, g, request, current_app
 from webargs.flaskparser import use_args
 
-from library_app import db
+from library_app import db, entity_cache
 from library_app.auth import auth_bp
-from library_app.models import user_schema, User, UserSchema, user_password_update_schema
-from library_app.utils import validate_json_content_type, token_required
+from library_app.models import user_schema, User, UserSchema, user_password_update_schema, RefreshToken, \
+    refresh_token_schema
+from library_app.ratelimit import auth_rate_limited
+from library_app.revocation import get_revocation_list
+from library_app.utils import validate_json_content_type, token_required, commit_or_conflict
 
 
 @auth_bp.post('/register')
+@auth_rate_limited
 @validate_json_content_type
 @use_args(user_schema, error_status_code=400)
 def register(args: dict):
-    if User.query.filter(User.username == args['username']).first():
-        abort(409, description=f'User with username {args["username"]} already exists')
-
-    if User.query.filter(User.email == args['email']).first():
-        abort(409, description=f'User with email {args["email"]} already exists')
-
     args['password'] = User.generate_hashed_password(args['password'])
     user = User(**args)
+    refresh_token = user.generate_refresh_token()
 
     db.session.add(user)
-    db.session.commit()
+    commit_or_conflict({
+        'username': f'User with username {args["username"]} already exists',
+        'email': f'User with email {args["email"]} already exists'
+    })
 
     token = user.generate_jwt()
 
     return jsonify({
         'success': True,
-        'token': token
+        'token': token,
+        'refresh_token': refresh_token
     }), 201
 
 
 @auth_bp.post('/login')
+@auth_rate_limited
 @validate_json_content_type
 @use_args(UserSchema(only=['username', 'password']), error_status_code=400)
 def login(args: dict):
@@ -41,20 +47,103 @@ def login(args: dict):
 
     if not user.is_password_valid(args['password']):
         abort(401, description='Invalid credentials')
+    user.rehash_password_if_needed(args['password'])
+
+    token = user.generate_jwt()
+    refresh_token = user.generate_refresh_token()
+    db.session.commit()
+
+    return jsonify({
+        'success': True,
+        'token': token,
+        'refresh_token': refresh_token
+    })
+
 
+@auth_bp.post('/refresh')
+@validate_json_content_type
+@use_args(refresh_token_schema, error_status_code=400)
+def refresh(args: dict):
+    refresh_token = RefreshToken.query.filter(
+        RefreshToken.token_hash == RefreshToken.hash_token(args['refresh_token'])
+    ).first()
+    if refresh_token is None or refresh_token.expires_at <= datetime.utcnow():
+        abort(401, description='Invalid refresh token. Please login')
+
+    if not refresh_token.revoke():
+        # a rotated token has been used again, so it may have been stolen
+        RefreshToken.revoke_all(refresh_token.user_id)
+        db.session.commit()
+        abort(401, description='Invalid refresh token. Please login')
+
+    user = refresh_token.user
     token = user.generate_jwt()
+    new_refresh_token = user.generate_refresh_token()
+    db.session.commit()
+
     return jsonify({
         'success': True,
         'token': token,
+        'refresh_token': new_refresh_token
+    })
+
+
+@auth_bp.post('/logout')
+@token_required
+def logout(user_id: int):
+    payload = g.token_payload
+    if 'jti' in payload:
+        get_revocation_list().revoke(payload['jti'], datetime.utcfromtimestamp(payload['exp']))
+
+    data = request.get_json(silent=True) or {}
+    if data.get('refresh_token'):
+        RefreshToken.query.filter(
+            RefreshToken.token_hash == RefreshToken.hash_token(data['refresh_token']),
+            RefreshToken.user_id == user_id,
+            RefreshToken.revoked_at.is_(None)
+        ).update({'revoked_at': datetime.utcnow()}, synchronize_session=False)
+
+    db.session.commit()
+    return jsonify({
+        'success': True,
+        'data': 'You have been logged out'
     })
 
 
+@entity_cache.loader('users')
+def load_user(user_id: int):
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+    return user_schema.dump(user), []
+
+
+def get_token_version_timeout() -> int:
+    return current_app.config.get('TOKEN_VERSION_CACHE_TIMEOUT', 5)
+
+
+# other workers accept tokens of an old version for up to TOKEN_VERSION_CACHE_TIMEOUT seconds
+@entity_cache.loader('token_versions', timeout=get_token_version_timeout)
+def load_token_version(user_id: int):
+    token_version = db.session.query(User.token_version).filter(User.id == user_id).scalar()
+    if token_version is None:
+        return None
+    # invalidated together with the user record on every change of the user
+    return {'token_version': token_version}, [('users', user_id)]
+
+
 @auth_bp.get('/me')
 @token_required
 def get_current_user(user_id: int):
-    user = User.query.get_or_404(user_id,
-                                 description=f'User with id {user_id} not found')
-    data = user_schema.dump(user)
+    data = g.token_payload.get('identity')
+    if request.args.get('fresh', 0, type=int):
+        loaded = load_user(user_id)
+        data = loaded[0] if loaded is not None else None
+    elif data is None:
+        data = entity_cache.get_or_load('users', user_id)
+    if data is None:
+        abort(404, description=f'User with id {user_id} not found')
+
     return jsonify(
         {'success': True,
          'data': data}
@@ -73,13 +162,18 @@ def update_password(user_id: int, args: dict):
         abort(401, description='Invalid password')
 
     user.password = user.generate_hashed_password(args['new_password'])
+    user.invalidate_tokens()
+    RefreshToken.revoke_all(user.id)
+    refresh_token = user.generate_refresh_token()
 
     db.session.commit()
 
     data = user_schema.dump(user)
     return jsonify(
         {'success': True,
-         'data': data}
+         'data': data,
+         'token': user.generate_jwt(),
+         'refresh_token': refresh_token}
     )
 
 
@@ -91,22 +185,22 @@ def update_user_data(user_id: int, args: dict):
     user = User.query.get_or_404(user_id,
                                  description=f'User with id: {user_id} not found')
 
-    if User.query.filter(
-            User.username == args['username'], user.username != args['username']
-    ).first():
-        abort(409, description=f'User with username {args["username"]} already exists')
-    if User.query.filter(
-            User.email == args['email'], user.email != args['email']
-    ).first():
-        abort(409, description=f'User with email {args["email"]} already exists')
-
+    # before the changes, as the update would autoflush them ahead of commit_or_conflict
+    RefreshToken.revoke_all(user.id)
     user.username = args['username']
     user.email = args['email']
+    user.invalidate_tokens()
+    refresh_token = user.generate_refresh_token()
 
-    db.session.commit()
+    commit_or_conflict({
+        'username': f'User with username {args["username"]} already exists',
+        'email': f'User with email {args["email"]} already exists'
+    })
 
     data = user_schema.dump(user)
     return jsonify(
         {'success': True,
-         'data': data}
+         'data': data,
+         'token': user.generate_jwt(),
+         'refresh_token': refresh_token}
     )
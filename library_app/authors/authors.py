@@ -1,20 +1,49 @@
-from flask import jsonify
+from typing import Optional
+
+from flask import jsonify, abort, request, current_app, g
+from sqlalchemy import func, literal_column, select, union_all
 from webargs.flaskparser import use_args
 
-from library_app import db
+from library_app import db, result_cache, entity_cache
 from library_app.authors import authors_bp
-from library_app.models import Author, AuthorSchema, author_schema
+from library_app.cache import invalidate_on_commit
+from library_app.models import Author, AuthorSchema, author_schema, Book, DeletedRecord
+from library_app.suggest import get_prefix_index, get_name_keys, prefix_range
 from library_app.utils import validate_json_content_type, get_schema_args, \
-    apply_order, apply_filter, get_pagination, token_required
+    apply_order, apply_filter, get_pagination, token_required, apply_include, \
+    apply_projection, get_export_response, update_returning, conditional, get_tables_version
+
+
+def get_authors_version() -> str:
+    return get_tables_version(Author, Book)
+
+
+def get_author_names_version() -> str:
+    return get_tables_version(Author)
+
+
+def get_author_version(author_id: int) -> Optional[str]:
+    row = db.session.query(Author.updated_at, func.max(Book.updated_at), func.count(Book.id)) \
+        .outerjoin(Author.books) \
+        .filter(Author.id == author_id) \
+        .group_by(Author.id) \
+        .first()
+    if row is None:
+        return None
+    return ':'.join(str(value) for value in row)
 
 
 @authors_bp.route('/authors', methods=['GET'])
+@conditional(get_authors_version)
+@result_cache.cached(get_authors_version)
 def get_authors():
     query = Author.query
 
     schema_args = get_schema_args(Author)
     query = apply_order(Author, query)
     query = apply_filter(Author, query)
+    query = apply_include(Author, query)
+    query = apply_projection(Author, query)
 
     items, pagination = get_pagination(query, 'authors.get_authors')
 
@@ -28,11 +57,106 @@ def get_authors():
     }), 200
 
 
+def load_author_names():
+    rows = db.session.query(Author.id, Author.first_name, Author.last_name) \
+        .execution_options(stream_results=True) \
+        .yield_per(current_app.config.get('EXPORT_BATCH_SIZE', 1000))
+    for author_id, first_name, last_name in rows:
+        record = {'id': author_id, 'first_name': first_name, 'last_name': last_name}
+        yield author_id, record, (first_name, last_name, f'{first_name} {last_name}')
+
+
+def get_author_suggestions_query(terms: str, limit: int):
+    """Authors whose first, last or full name starts with ``terms``, with the matched key.
+
+    One subquery per name index, each reading its first ``limit`` matches in
+    index order, so no query sorts all the matches of a short prefix.
+    """
+    columns = (Author.id, Author.first_name, Author.last_name)
+    subqueries = [
+        select(*columns, key.label('key')).where(prefix_range(key, terms)).order_by(key).limit(limit).subquery()
+        for key in get_name_keys(Author.first_name, Author.last_name)
+    ]
+    return union_all(*(select(*subquery.c) for subquery in subqueries))
+
+
+def suggest_authors_from_database(terms: str, limit: int) -> list:
+    # the same order as the in-process prefix index: by matched key, then id
+    rows = sorted(db.session.execute(get_author_suggestions_query(terms, limit)), key=lambda row: (row.key, row.id))
+    suggestions = {}
+    for row in rows:
+        if len(suggestions) >= limit:
+            break
+        suggestions.setdefault(row.id, row)
+    rows = list(suggestions.values())
+
+    if len(rows) < limit and db.engine.dialect.name == 'postgresql':
+        # fill up with similar names (pg_trgm) to tolerate typos
+        full_name = func.lower(Author.first_name + literal_column("' '") + Author.last_name)
+        rows += db.session.query(Author.id, Author.first_name, Author.last_name) \
+            .filter(full_name.op('%')(terms), Author.id.notin_([row.id for row in rows])) \
+            .order_by(func.similarity(full_name, terms).desc(), Author.id) \
+            .limit(limit - len(rows)) \
+            .all()
+
+    return [{'id': row.id, 'first_name': row.first_name, 'last_name': row.last_name} for row in rows]
+
+
+@authors_bp.route('/authors/suggest', methods=['GET'])
+@result_cache.cached(get_author_names_version)
+def suggest_authors():
+    terms = ' '.join(request.args.get('q', '').lower().split())
+    if not terms:
+        abort(400, description='Search query q is required')
+    limit = request.args.get('limit', current_app.config.get('AUTHOR_SUGGEST_LIMIT', 10), type=int)
+    limit = max(1, min(limit, current_app.config.get('AUTHOR_SUGGEST_MAX_LIMIT', 50)))
+
+    source = current_app.config.get('AUTHOR_SUGGEST_SOURCE', 'auto')
+    if source == 'auto':
+        source = 'database' if db.engine.dialect.name == 'postgresql' else 'memory'
+    prefix_index = get_prefix_index('authors', load_author_names, get_author_names_version()) \
+        if source == 'memory' else None
+
+    if prefix_index is not None:
+        data = prefix_index.search(terms, limit)
+    else:
+        data = suggest_authors_from_database(terms, limit)
+
+    return jsonify({
+        'success': True,
+        'data': data,
+        'number_of_records': len(data)
+    }), 200
+
+
+@authors_bp.route('/authors/export', methods=['GET'])
+def export_authors():
+    query = Author.query
+
+    schema_args = get_schema_args(Author)
+    query = apply_order(Author, query)
+    query = apply_filter(Author, query)
+    query = apply_include(Author, query)
+    query = apply_projection(Author, query)
+
+    return get_export_response(query, AuthorSchema(**schema_args), 'authors')
+
+
+@entity_cache.loader('authors', version=get_author_version)
+def load_author(author_id: int):
+    author = Author.query.get(author_id)
+    if author is None:
+        return None
+    return author_schema.dump(author), [('books', book.id) for book in author.books]
+
+
 @authors_bp.route('/authors/<int:author_id>', methods=['GET'])
+@conditional(get_author_version)
 def get_author(author_id: int):
-    author = Author.query.get_or_404(author_id,
-                                     description=f'Author with id: {author_id} not found')
-    data = author_schema.dump(author)
+    data = entity_cache.get_or_load('authors', author_id, g.get('resource_version'))
+    if data is None:
+        abort(404, description=f'Author with id: {author_id} not found')
+
     return jsonify({
         'success': True,
         'data': data
@@ -76,12 +200,37 @@ def update_author(user_id: int, args: dict, author_id: int):
     })
 
 
+@authors_bp.route('/authors/<int:author_id>', methods=['PATCH'])
+@token_required
+@validate_json_content_type
+@use_args(AuthorSchema(partial=True, exclude=['books']), error_status_code=400)
+def patch_author(user_id: int, args: dict, author_id: int):
+    if not args:
+        abort(400, description='At least one field to update is required')
+
+    author = update_returning(Author, author_id, args)
+    if author is None:
+        abort(404, description=f'Author with id: {author_id} not found')
+    db.session.commit()
+
+    data = AuthorSchema(exclude=['books']).dump(author)
+    return jsonify({
+        'success': True,
+        'data': data
+    })
+
+
 @authors_bp.route('/authors/<int:author_id>', methods=['DELETE'])
 @token_required
 def delete_author(user_id: int, author_id: int):
-    author = Author.query.get_or_404(author_id,
-                                     description=f'Author with id: {author_id} not found')
-    db.session.delete(author)
+    DeletedRecord.record(Book, Book.author_id == author_id)
+    DeletedRecord.record(Author, Author.id == author_id)
+    deleted = Author.query.filter(Author.id == author_id).delete(synchronize_session=False)
+    # the books deleted by the cascade are invalidated as dependents of the author
+    invalidate_on_commit(db.session, ('authors', author_id))
+    if not deleted:
+        abort(404, description=f'Author with id: {author_id} not found')
+
     db.session.commit()
     return jsonify({
         'success': True,
@@ -1,20 +1,90 @@
-from flask import jsonify, abort
+from typing import Optional
+
+from flask import jsonify, abort, request, g
+from sqlalchemy.exc import IntegrityError
 from webargs.flaskparser import use_args
 
-from library_app import db
+from library_app import db, result_cache, entity_cache
 from library_app.books import books_bp
-from library_app.models import Book, BookSchema, book_schema, Author
+from library_app.cache import invalidate_on_commit
+from library_app.models import Book, BookSchema, book_schema, Author, DeletedRecord
+from library_app.query_spec import get_query_spec, get_list_coercer, MAX_IN_VALUES
+from library_app.search import apply_search
 from library_app.utils import validate_json_content_type, get_schema_args, apply_order, apply_filter, get_pagination, \
-    token_required
+    token_required, apply_include, apply_projection, get_export_response, commit_or_conflict, handle_conflicts, \
+    update_returning, conditional, get_tables_version, RESERVED_PARAMS
+
+
+def get_books_version() -> str:
+    return get_tables_version(Book, Author)
+
+
+def get_book_version(book_id: int) -> Optional[str]:
+    row = db.session.query(Book.updated_at, Author.updated_at) \
+        .join(Book.author) \
+        .filter(Book.id == book_id) \
+        .first()
+    if row is None:
+        return None
+    return f'{row[0]}:{row[1]}'
+
+
+MULTI_GET_PARAMS = {'ids': 'id', 'isbns': 'isbn'}
+
+
+def get_books_by_keys(param: str):
+    """Return the books listed in the parameter, in request order, with a marker for each missing book."""
+    column_name = MULTI_GET_PARAMS[param]
+    unexpected = [name for name in request.args if name not in RESERVED_PARAMS and name != param]
+    if unexpected:
+        abort(400, description=f'{param} cannot be combined with: {", ".join(unexpected)}')
+
+    column_attr, coerce = get_query_spec(Book).columns[column_name]
+    try:
+        keys = get_list_coercer(coerce)(request.args[param])
+    except ValueError:
+        abort(400, description=f'{param} must be a list of at most {MAX_IN_VALUES} comma separated values')
+
+    schema_args = get_schema_args(Book)
+    query = apply_include(Book, Book.query.filter(column_attr.in_(set(keys))))
+    books = query.all()
+    dumped = {
+        getattr(book, column_name): data for book, data in zip(books, BookSchema(**schema_args).dump(books))
+    }
+
+    results = []
+    for key in keys:
+        if key in dumped:
+            results.append({'success': True, column_name: key, 'data': dumped[key]})
+        else:
+            results.append({
+                'success': False,
+                column_name: key,
+                'message': f'Book with {column_name}: {key} not found'
+            })
+
+    return jsonify({
+        'success': True,
+        'data': results,
+        'number_of_records': len(dumped)
+    }), 200
 
 
 @books_bp.get('/books')
+@conditional(get_books_version)
+@result_cache.cached(get_books_version)
 def get_books():
+    for param in MULTI_GET_PARAMS:
+        if param in request.args:
+            return get_books_by_keys(param)
+
     query = Book.query
 
     schema_args = get_schema_args(Book)
     query = apply_order(Book, query)
     query = apply_filter(Book, query)
+    query = apply_include(Book, query)
+    query = apply_projection(Book, query)
 
     items, pagination = get_pagination(query, 'books.get_books')
 
@@ -27,12 +97,63 @@ def get_books():
     }), 200
 
 
+@books_bp.get('/books/search')
+@conditional(get_books_version)
+@result_cache.cached(get_books_version)
+def search_books():
+    terms = request.args.get('q', '').strip()
+    if not terms:
+        abort(400, description='Search query q is required')
+    if 'cursor' in request.args:
+        abort(400, description='Search results are paginated by page, not cursor')
+
+    query = Book.query
+
+    schema_args = get_schema_args(Book)
+    query = apply_search(Book, query, terms)
+    query = apply_filter(Book, query)
+    query = apply_include(Book, query)
+    query = apply_projection(Book, query)
+
+    items, pagination = get_pagination(query, 'books.search_books')
+
+    data = BookSchema(**schema_args).dump(items)
+    return jsonify({
+        'success': True,
+        'data': data,
+        'number_of_records': len(items),
+        'pagination': pagination
+    }), 200
+
+
+@books_bp.get('/books/export')
+def export_books():
+    query = Book.query
+
+    schema_args = get_schema_args(Book)
+    query = apply_order(Book, query)
+    query = apply_filter(Book, query)
+    query = apply_include(Book, query)
+    query = apply_projection(Book, query)
+
+    return get_export_response(query, BookSchema(**schema_args), 'books')
+
+
+@entity_cache.loader('books', version=get_book_version)
+def load_book(book_id: int):
+    book = Book.query.get(book_id)
+    if book is None:
+        return None
+    return book_schema.dump(book), [('authors', book.author_id)]
+
+
 @books_bp.get('/books/<int:book_id>')
+@conditional(get_book_version)
 def get_book(book_id: int):
-    book = Book.query.get_or_404(book_id,
-                                 description=f'Book with id: {book_id} not found')
+    data = entity_cache.get_or_load('books', book_id, g.get('resource_version'))
+    if data is None:
+        abort(404, description=f'Book with id: {book_id} not found')
 
-    data = book_schema.dump(book)
     return jsonify({
         'success': True,
         'data': data,
@@ -47,8 +168,11 @@ def update_book(user_id: int, args: dict, book_id: int):
     book = Book.query.get_or_404(book_id,
                                  description=f'Book with id: {book_id} not found')
 
-    if Book.query.filter(Book.isbn == args['isbn'], book.isbn != args['isbn']).first():
-        abort(409, description=f'Book with ISBN {args["isbn"]} already exists')
+    author_id = args.get('author_id')
+    if author_id is not None:
+        Author.query.get_or_404(author_id,
+                                description=f'Author with id: {author_id} not found')
+        book.author_id = author_id
 
     book.title = args['title']
     book.isbn = args['isbn']
@@ -58,14 +182,34 @@ def update_book(user_id: int, args: dict, book_id: int):
     if description is not None:
         book.description = description
 
+    commit_or_conflict({'isbn': f'Book with ISBN {args["isbn"]} already exists'})
+    data = book_schema.dump(book)
+    return jsonify({
+        'success': True,
+        'data': data,
+    })
+
+
+@books_bp.patch('/books/<int:book_id>')
+@token_required
+@validate_json_content_type
+@use_args(BookSchema(partial=True, exclude=['author']), error_status_code=400)
+def patch_book(user_id: int, args: dict, book_id: int):
+    if not args:
+        abort(400, description='At least one field to update is required')
+
     author_id = args.get('author_id')
     if author_id is not None:
         Author.query.get_or_404(author_id,
                                 description=f'Author with id: {author_id} not found')
-        book.author_id = author_id
 
+    with handle_conflicts({'isbn': f'Book with ISBN {args.get("isbn")} already exists'}):
+        book = update_returning(Book, book_id, args)
+    if book is None:
+        abort(404, description=f'Book with id: {book_id} not found')
     db.session.commit()
-    data = book_schema.dump(book)
+
+    data = BookSchema(exclude=['author']).dump(book)
     return jsonify({
         'success': True,
         'data': data,
@@ -75,10 +219,12 @@ def update_book(user_id: int, args: dict, book_id: int):
 @books_bp.delete('/books/<int:book_id>')
 @token_required
 def delete_books(user_id: int, book_id: int):
-    book = Book.query.get_or_404(book_id,
-                                 description=f'Book with id: {book_id} not found')
+    DeletedRecord.record(Book, Book.id == book_id)
+    deleted = Book.query.filter(Book.id == book_id).delete(synchronize_session=False)
+    invalidate_on_commit(db.session, ('books', book_id))
+    if not deleted:
+        abort(404, description=f'Book with id: {book_id} not found')
 
-    db.session.delete(book)
     db.session.commit()
     return jsonify({
         'success': True,
@@ -110,13 +256,10 @@ def create_books(user_id: int, args: dict, author_id: int):
     Author.query.get_or_404(author_id,
                             description=f'Author with id: {author_id} not found')
 
-    if Book.query.filter(Book.isbn == args['isbn']).first():
-        abort(409, description=f'Book with ISBN {args["isbn"]} already exists')
-
     book = Book(author_id=author_id, **args)
 
     db.session.add(book)
-    db.session.commit()
+    commit_or_conflict({'isbn': f'Book with ISBN {args["isbn"]} already exists'})
 
     data = book_schema.dump(book)
     return jsonify({
@@ -124,3 +267,58 @@ def create_books(user_id: int, args: dict, author_id: int):
         'data': data
     }), 201
 
+
+@books_bp.post('/authors/<int:author_id>/books/batch')
+@token_required
+@validate_json_content_type
+@use_args(BookSchema(many=True, exclude=['author_id']), error_status_code=400)
+def create_books_batch(user_id: int, args: list, author_id: int):
+    Author.query.get_or_404(author_id,
+                            description=f'Author with id: {author_id} not found')
+    if not args:
+        abort(400, description='At least one book is required')
+
+    isbns = {book['isbn'] for book in args}
+    taken_isbns = {isbn for isbn, in db.session.query(Book.isbn).filter(Book.isbn.in_(isbns))}
+
+    results = []
+    new_books = []
+    for book in args:
+        if book['isbn'] in taken_isbns:
+            results.append({
+                'success': False,
+                'isbn': book['isbn'],
+                'message': f'Book with ISBN {book["isbn"]} already exists'
+            })
+            continue
+        taken_isbns.add(book['isbn'])
+        # executemany takes its columns from the first row, so every row needs the optional ones too
+        new_books.append({'description': None, **book, 'author_id': author_id})
+        results.append({'success': True, 'isbn': book['isbn']})
+
+    if not new_books:
+        return jsonify({
+            'success': False,
+            'data': results
+        }), 409
+
+    try:
+        db.session.execute(Book.__table__.insert(), new_books)
+        invalidate_on_commit(db.session, ('authors', author_id))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(409, description='Some of the books have been created in the meantime. Please try again')
+
+    created_ids = dict(
+        db.session.query(Book.isbn, Book.id).filter(Book.isbn.in_([book['isbn'] for book in new_books]))
+    )
+    for result in results:
+        if result['success']:
+            result['id'] = created_ids[result['isbn']]
+
+    return jsonify({
+        'success': True,
+        'data': results,
+        'number_of_records': len(new_books)
+    }), 201
@@ -0,0 +1,409 @@
+import hashlib
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from typing import Optional, Callable, Iterable, Tuple
+from urllib.parse import urlencode
+
+from flask import current_app, request, make_response, has_app_context, g
+from sqlalchemy import event, inspect, table, column
+from sqlalchemy.orm import Session, MANYTOONE
+
+
+class LRUCacheBackend:
+    """In-process cache with least recently used eviction and optional expiry."""
+
+    def __init__(self, max_size: int = 1024, timeout: Optional[int] = None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._values = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self._values[key]
+                return None
+            self._values.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            expires_at = time.monotonic() + self.timeout if self.timeout else None
+            self._values[key] = (expires_at, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+
+class RedisCacheBackend:
+    """Cache shared between workers, stored in Redis (requires the ``redis`` package)."""
+
+    def __init__(self, url: str, timeout: Optional[int] = None, prefix: str = 'library:'):
+        try:
+            import redis
+        except ImportError as error:
+            raise RuntimeError('The redis package is required for the redis cache backend') from error
+        self._client = redis.Redis.from_url(url)
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self._client.set(self.prefix + key, value, ex=self.timeout)
+
+
+def get_backend():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('result_cache')
+
+
+def create_backend(config: dict):
+    cache_type = config.get('RESULT_CACHE_TYPE')
+    if cache_type == 'memory':
+        return LRUCacheBackend(config.get('RESULT_CACHE_MAX_SIZE', 1024), config.get('RESULT_CACHE_TIMEOUT'))
+    if cache_type == 'redis':
+        return RedisCacheBackend(config.get('RESULT_CACHE_REDIS_URL'),
+                                 config.get('RESULT_CACHE_TIMEOUT'))
+    return None
+
+
+class ResultCache:
+    """Cache of GET responses keyed by the version of the data they depend on.
+
+    The version is read from the database (the same one ``conditional`` uses
+    for ETags, reused when that decorator already read it), so writes of any
+    worker change the key. Responses of old versions age out of the backend.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['result_cache'] = create_backend(app.config)
+
+    @staticmethod
+    def make_key(version: str) -> str:
+        args = urlencode(sorted(request.args.items(multi=True)))
+        digest = hashlib.sha1(f'{version}:{args}'.encode()).hexdigest()
+        return f'{request.endpoint}:{digest}'
+
+    def cached(self, get_version: Callable[..., Optional[str]]):
+        """Cache successful responses of the view for each version returned by ``get_version``."""
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                backend = get_backend()
+                if backend is None:
+                    return func(*args, **kwargs)
+                version = g.get('resource_version') or get_version(**kwargs)
+                if version is None:
+                    return func(*args, **kwargs)
+
+                key = self.make_key(version)
+                body = backend.get(key)
+                if body is not None:
+                    return current_app.response_class(body, mimetype='application/json')
+
+                response = make_response(func(*args, **kwargs))
+                if response.status_code == 200:
+                    backend.set(key, response.get_data())
+                return response
+
+            return wrapper
+
+        return decorator
+
+
+class EntityStore:
+    """Bounded TTL and LRU store of serialized records keyed by ``(table, id)``.
+
+    A record may declare the records embedded in its payload (``related``);
+    invalidating one of them invalidates the record as well. A record stored
+    with a ``version`` is only returned to readers asking for that version.
+    """
+
+    def __init__(self, max_size: int = 4096, timeout: int = 300):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._dependents = {}
+        self._lock = Lock()
+
+    def get(self, key: tuple, version: Optional[str] = None) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            expired = entry is not None and (
+                entry[0] < time.monotonic() or (version is not None and entry[3] != version)
+            )
+            if entry is None or expired:
+                if expired:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: tuple, payload: dict, related: Iterable[tuple] = (), version: Optional[str] = None,
+            timeout: Optional[int] = None) -> None:
+        with self._lock:
+            self._remove(key)
+            related = tuple(related)
+            expires_at = time.monotonic() + (self.timeout if timeout is None else min(timeout, self.timeout))
+            self._entries[key] = (expires_at, payload, related, version)
+            for related_key in related:
+                self._dependents.setdefault(related_key, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, key: tuple) -> None:
+        with self._lock:
+            self._invalidate(key)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def _invalidate(self, key: tuple) -> None:
+        self._remove(key)
+        for dependent_key in self._dependents.pop(key, ()):
+            self._invalidate(dependent_key)
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for related_key in entry[2]:
+            dependents = self._dependents.get(related_key)
+            if dependents is not None:
+                dependents.discard(key)
+                if not dependents:
+                    del self._dependents[related_key]
+
+
+def get_entity_store() -> Optional[EntityStore]:
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('entity_cache')
+
+
+class EntityCache:
+    """Cache of serialized single records, invalidated by ORM writes.
+
+    Records are produced by loaders registered per table with
+    :meth:`loader`. A loader returns the payload and the keys of the records
+    embedded in it, or ``None`` when the record does not exist.
+
+    Writes of other processes do not invalidate the cache. Readers that know
+    the current version of the record (e.g. the ETag version read by
+    ``conditional``) pass it to :meth:`get_or_load`, and the record is
+    reloaded whenever the cached payload belongs to another version.
+    """
+
+    def __init__(self, app=None):
+        self._loaders = {}
+        self._timeouts = {}
+        self._versions = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        max_size = app.config.get('ENTITY_CACHE_MAX_SIZE', 4096)
+        app.extensions['entity_cache'] = (
+            EntityStore(max_size, app.config.get('ENTITY_CACHE_TIMEOUT', 300)) if max_size else None
+        )
+        if app.config.get('ENTITY_CACHE_WARM_IDS'):
+            app.before_first_request(self.warm)
+
+    def loader(self, table: str, timeout: Optional[Callable[[], int]] = None,
+               version: Optional[Callable[[int], Optional[str]]] = None):
+        """Register the loader of the table.
+
+        ``timeout`` returns a lifetime shorter than ``ENTITY_CACHE_TIMEOUT``
+        for records that other processes must not see stale for long.
+        ``version`` returns the version of a record, the one readers pass to
+        :meth:`get_or_load`; :meth:`warm` stores records under it.
+        """
+
+        def decorator(func: Callable[[int], Optional[Tuple[dict, list]]]):
+            self._loaders[table] = func
+            if timeout is not None:
+                self._timeouts[table] = timeout
+            if version is not None:
+                self._versions[table] = version
+            return func
+
+        return decorator
+
+    def get_or_load(self, table: str, record_id: int, version: Optional[str] = None) -> Optional[dict]:
+        store = get_entity_store()
+        if store is not None:
+            payload = store.get((table, record_id), version)
+            if payload is not None:
+                return payload
+
+        loaded = self._loaders[table](record_id)
+        if loaded is None:
+            return None
+        payload, related = loaded
+        if store is not None:
+            timeout = self._timeouts.get(table)
+            store.set((table, record_id), payload, related, version, timeout() if timeout is not None else None)
+        return payload
+
+    def warm(self) -> None:
+        """Load the records listed in ``ENTITY_CACHE_WARM_IDS`` ahead of the first requests."""
+        for table, record_ids in current_app.config.get('ENTITY_CACHE_WARM_IDS', {}).items():
+            get_version = self._versions.get(table)
+            for record_id in record_ids:
+                self.get_or_load(table, record_id, get_version(record_id) if get_version is not None else None)
+
+    @staticmethod
+    def stats() -> dict:
+        store = get_entity_store()
+        if store is None:
+            return {'hits': 0, 'misses': 0, 'size': 0}
+        return store.stats()
+
+
+class VerifiedTokenCache:
+    """LRU of already verified tokens, valid until the ``exp`` claim of each token.
+
+    Tokens are keyed by their SHA-256 digest so raw tokens are not kept in
+    memory.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._payloads = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _make_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._make_key(token)
+        with self._lock:
+            payload = self._payloads.get(key)
+            if payload is None:
+                return None
+            # same rule as PyJWT: a token expires once exp <= now in whole seconds
+            if payload['exp'] <= int(time.time()):
+                del self._payloads[key]
+                return None
+            self._payloads.move_to_end(key)
+            return payload
+
+    def set(self, token: str, payload: dict) -> None:
+        if 'exp' not in payload:
+            return
+        key = self._make_key(token)
+        with self._lock:
+            self._payloads[key] = payload
+            self._payloads.move_to_end(key)
+            while len(self._payloads) > self.max_size:
+                self._payloads.popitem(last=False)
+
+    def discard(self, token: str) -> None:
+        with self._lock:
+            self._payloads.pop(self._make_key(token), None)
+
+
+def get_token_cache() -> Optional[VerifiedTokenCache]:
+    max_size = current_app.config.get('TOKEN_CACHE_MAX_SIZE', 1024)
+    if not max_size:
+        return None
+    return current_app.extensions.setdefault('token_cache', VerifiedTokenCache(max_size))
+
+
+def _get_changed_tables(session: Session) -> set:
+    return session.info.setdefault('changed_tables', set())
+
+
+def _get_changed_entities(session: Session) -> set:
+    return session.info.setdefault('changed_entities', set())
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flushed_tables(session, flush_context):
+    changed_tables = _get_changed_tables(session)
+    changed_entities = _get_changed_entities(session)
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        state = inspect(instance)
+        table = state.mapper.local_table.name
+        changed_tables.add(table)
+        changed_entities.add((table, state.mapper.primary_key_from_instance(instance)[0]))
+
+        # parents embed their collections, so they change together with their children
+        for relationship in state.mapper.relationships:
+            if relationship.direction is not MANYTOONE:
+                continue
+            parent_table = relationship.mapper.local_table.name
+            for local_column, _ in relationship.local_remote_pairs:
+                history = state.attrs[state.mapper.get_property_by_column(local_column).key].history
+                for value in (*history.added, *history.unchanged, *history.deleted):
+                    if value is not None:
+                        changed_entities.add((parent_table, value))
+
+
+table_versions = table('table_versions', column('table_name'), column('version'))
+
+
+def invalidate_on_commit(session: Session, *keys: tuple) -> None:
+    """Invalidate the entity cache entries of ``keys`` (and their dependents) once the session commits.
+
+    For statements that bypass the unit of work, whose changed records the
+    ``after_flush`` tracking cannot see.
+    """
+    _get_changed_entities(session).update(keys)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_executed_tables(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table_name = orm_execute_state.statement.table.name
+        if table_name != table_versions.name:
+            _get_changed_tables(orm_execute_state.session).add(table_name)
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_table_versions(session):
+    # changes still pending are flushed only after this event
+    session.flush()
+    changed_tables = session.info.get('changed_tables')
+    if changed_tables:
+        # in a fixed order, so concurrent writers lock the counters without deadlocks
+        for table_name in sorted(changed_tables):
+            session.execute(
+                table_versions.update()
+                .where(table_versions.c.table_name == table_name)
+                .values(version=table_versions.c.version + 1)
+            )
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_entities(session):
+    session.info.pop('changed_tables', None)
+    changed_entities = session.info.pop('changed_entities', set())
+    store = get_entity_store()
+    if store is not None:
+        for key in changed_entities:
+            store.invalidate(key)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+    session.info.pop('changed_entities', None)
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+changes_bp = Blueprint('changes', __name__)
+
+from library_app.changes import changes
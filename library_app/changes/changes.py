@@ -0,0 +1,107 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from flask import jsonify, request, abort, current_app
+from sqlalchemy import and_, or_, true
+from sqlalchemy.orm import joinedload
+
+from library_app.changes import changes_bp
+from library_app.models import Author, Book, DeletedRecord, AuthorSchema, BookSchema
+
+# rank, resource name, query factory, timestamp column
+CHANGE_SOURCES = (
+    (0, 'authors', lambda: Author.query, Author.updated_at),
+    (1, 'books', lambda: Book.query.options(joinedload(Book.author)), Book.updated_at),
+    (2, 'deleted_records', lambda: DeletedRecord.query, DeletedRecord.deleted_at),
+)
+SCHEMAS = {
+    'authors': AuthorSchema(exclude=['books']),
+    'books': BookSchema()
+}
+
+
+def _encode_cursor(position: tuple) -> str:
+    timestamp, rank, record_id = position
+    payload = json.dumps([timestamp.isoformat(), rank, record_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def _decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int, int]]:
+    if not cursor:
+        return None
+    try:
+        timestamp, rank, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), int(rank), int(record_id)
+    except (binascii.Error, ValueError, TypeError):
+        abort(400, description='Invalid cursor')
+
+
+def _get_seek_condition(timestamp_attr, id_attr, rank: int, since: Optional[tuple]):
+    if since is None:
+        return true()
+    timestamp, since_rank, record_id = since
+    if rank > since_rank:
+        return timestamp_attr >= timestamp
+    if rank < since_rank:
+        return timestamp_attr > timestamp
+    return or_(timestamp_attr > timestamp, and_(timestamp_attr == timestamp, id_attr > record_id))
+
+
+def _serialize_change(record, resource: str, since: Optional[tuple]) -> dict:
+    if resource == 'deleted_records':
+        return {
+            'type': 'deleted',
+            'resource': record.table_name,
+            'id': record.record_id,
+            'timestamp': record.deleted_at.isoformat()
+        }
+    created = since is None or record.created_at > since[0]
+    return {
+        'type': 'created' if created else 'updated',
+        'resource': resource,
+        'id': record.id,
+        'timestamp': record.updated_at.isoformat(),
+        'data': SCHEMAS[resource].dump(record)
+    }
+
+
+@changes_bp.get('/changes')
+def get_changes():
+    """Return records created, updated and deleted after the ``since`` cursor.
+
+    Changes are ordered by their timestamp. Only changes older than
+    ``CHANGES_SETTLE_SECONDS`` are returned, so that transactions still in
+    flight when the page is read cannot commit changes behind the cursor.
+    """
+    since = _decode_cursor(request.args.get('since'))
+    limit = request.args.get('limit', current_app.config.get('CHANGES_PER_PAGE', 100), type=int)
+    limit = max(1, min(limit, current_app.config.get('CHANGES_MAX_PER_PAGE', 1000)))
+    until = datetime.utcnow() - timedelta(seconds=current_app.config.get('CHANGES_SETTLE_SECONDS', 5))
+
+    changes = []
+    for rank, resource, get_query, timestamp_attr in CHANGE_SOURCES:
+        model = timestamp_attr.class_
+        records = get_query() \
+            .filter(_get_seek_condition(timestamp_attr, model.id, rank, since), timestamp_attr <= until) \
+            .order_by(timestamp_attr, model.id) \
+            .limit(limit + 1) \
+            .all()
+        changes.extend(
+            ((getattr(record, timestamp_attr.key), rank, record.id), resource, record) for record in records
+        )
+
+    changes.sort(key=lambda change: change[0])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    next_cursor = _encode_cursor(changes[-1][0]) if changes else request.args.get('since')
+    return jsonify({
+        'success': True,
+        'data': [_serialize_change(record, resource, since) for _, resource, record in changes],
+        'number_of_records': len(changes),
+        'has_more': has_more,
+        'next_cursor': next_cursor
+    })
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 db_manage_bp = Blueprint('db_manage', __name__, cli_group=None)
 
-from library_app.commands import db_manage_commands
\ No newline at end of file
+from library_app.commands import db_manage_commands, password_hash_commands, slow_query_commands
\ No newline at end of file
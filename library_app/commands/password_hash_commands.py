@@ -0,0 +1,26 @@
+import click
+from flask import current_app
+
+from library_app.commands import db_manage_bp
+from library_app.hashing import calibrate_iterations
+
+
+@db_manage_bp.cli.group()
+def password_hash():
+    """Password hashing commands"""
+    pass
+
+
+@password_hash.command()
+@click.option('--target-ms', default=250, show_default=True,
+              help='Target duration of a single password hash in milliseconds')
+def calibrate(target_ms: int):
+    """Calibrate password hashing cost to a target latency on this machine"""
+    method = current_app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    if not method.startswith('pbkdf2'):
+        print(f'Hashing method {method} has no configurable cost')
+        return
+
+    iterations = calibrate_iterations(target_ms, method)
+    print(f'{method} with {iterations} iterations takes about {target_ms} ms on this machine')
+    print(f'Set PASSWORD_HASH_ITERATIONS={iterations} in .env to use it')
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+from flask import current_app
+
+from library_app import db
+from library_app.advisor import read_slow_queries, get_index_recommendations
+from library_app.commands import db_manage_bp
+
+
+@db_manage_bp.cli.group()
+def slow_queries():
+    """Slow query advisor commands"""
+    pass
+
+
+@slow_queries.command()
+def report():
+    """Show logged slow queries grouped by filters and sort, with index recommendations"""
+    entries = read_slow_queries(current_app.config.get('SLOW_QUERY_LOG'))
+    if not entries:
+        print('No slow queries logged')
+        return
+
+    for recommendation in get_index_recommendations(db.engine, entries):
+        print(f'{recommendation["table"]}: filters {", ".join(recommendation["filters"]) or "-"}; '
+              f'sort {", ".join(recommendation["sort"]) or "-"}')
+        print(f'  {recommendation["count"]} slow queries, slowest {recommendation["max_duration_ms"]} ms')
+        for line in recommendation['plan']:
+            print(f'  plan: {line}')
+        if recommendation['index']:
+            print(f'  recommended: {recommendation["index"]}')
+        elif recommendation['covered_by']:
+            print(f'  covered by existing index on ({", ".join(recommendation["covered_by"])})')
+        if recommendation['excluded']:
+            print(f'  not indexed (unbounded text): {", ".join(recommendation["excluded"])}')
+
+
+@slow_queries.command()
+def clear():
+    """Remove the slow query log"""
+    Path(current_app.config.get('SLOW_QUERY_LOG')).unlink(missing_ok=True)
+    print('Slow query log has been cleared')
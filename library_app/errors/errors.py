@@ -21,7 +21,10 @@ class ErrorResponse:
 
 @errors_pb.app_errorhandler(400)
 def handle_400(error):
-    messages = error.data.get('messages', {}).get('json', {})
+    data = getattr(error, 'data', None)
+    if data is None:
+        return ErrorResponse(error.description, 400).to_response()
+    messages = data.get('messages', {}).get('json', {})
     return ErrorResponse(messages, 400).to_response()
 
 
@@ -45,7 +48,23 @@ def handle_415(error):
     return ErrorResponse(error.description, 415).to_response()
 
 
+@errors_pb.app_errorhandler(429)
+def handle_429(error):
+    response = ErrorResponse(error.description, 429).to_response()
+    if getattr(error, 'retry_after', None) is not None:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
 @errors_pb.app_errorhandler(500)
 def handle_500(error):
     db.session.rollback()
     return ErrorResponse(error.description, 500).to_response()
+
+
+@errors_pb.app_errorhandler(503)
+def handle_503(error):
+    response = ErrorResponse(error.description, 503).to_response()
+    if getattr(error, 'retry_after', None) is not None:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
@@ -0,0 +1,82 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import BoundedSemaphore
+from typing import Optional
+
+from flask import current_app, abort
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHasher:
+    """Password hashing with configurable method and cost.
+
+    With ``pool_size`` set, hashing runs in a bounded thread pool so that at
+    most ``pool_size`` hashes are computed at once, whatever the number of
+    request threads. With ``max_concurrent`` set, a request that cannot start
+    hashing within ``wait_seconds`` is rejected with 503 instead of queueing.
+    """
+
+    def __init__(self, method: str = 'pbkdf2:sha256', iterations: int = 260000,
+                 pool_size: int = 0, timeout: Optional[float] = None,
+                 max_concurrent: int = 0, wait_seconds: float = 0.5):
+        self.method = f'{method}:{iterations}' if method.startswith('pbkdf2') else method
+        self.timeout = timeout
+        self.wait_seconds = wait_seconds
+        self._executor = ThreadPoolExecutor(pool_size, thread_name_prefix='password-hasher') \
+            if pool_size else None
+        self._semaphore = BoundedSemaphore(max_concurrent) if max_concurrent else None
+
+    def _run(self, func, *args):
+        if self._semaphore is None:
+            return self._execute(func, *args)
+        if not self._semaphore.acquire(timeout=self.wait_seconds):
+            abort(503, description='Server is busy. Please try again later', retry_after=1)
+        try:
+            return self._execute(func, *args)
+        finally:
+            self._semaphore.release()
+
+    def _execute(self, func, *args):
+        if self._executor is None:
+            return func(*args)
+        future = self._executor.submit(func, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            abort(503, description='Server is busy. Please try again later', retry_after=1)
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, hashed_password: str, password: str) -> bool:
+        return self._run(check_password_hash, hashed_password, password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return hashed_password.split('$', 1)[0] != self.method
+
+
+def get_password_hasher() -> PasswordHasher:
+    password_hasher = current_app.extensions.get('password_hasher')
+    if password_hasher is None:
+        password_hasher = current_app.extensions.setdefault('password_hasher', PasswordHasher(
+            current_app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'),
+            current_app.config.get('PASSWORD_HASH_ITERATIONS', 260000),
+            current_app.config.get('PASSWORD_HASH_POOL_SIZE', 0),
+            current_app.config.get('PASSWORD_HASH_TIMEOUT'),
+            current_app.config.get('PASSWORD_HASH_MAX_CONCURRENT', 0),
+            current_app.config.get('PASSWORD_HASH_WAIT_SECONDS', 0.5)
+        ))
+    return password_hasher
+
+
+def calibrate_iterations(target_ms: float, method: str = 'pbkdf2:sha256', start: int = 10000) -> int:
+    """Return the number of iterations for which one hash takes about ``target_ms`` on this machine."""
+    iterations = start
+    while True:
+        started_at = time.perf_counter()
+        generate_password_hash('calibration', f'{method}:{iterations}')
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        if elapsed_ms >= target_ms / 2:
+            return max(int(iterations * target_ms / elapsed_ms), 1)
+        iterations *= 2
@@ -1,54 +1,105 @@
-from datetime import datetime, date, timedelta
+import hashlib
+import secrets
+import uuid
+from datetime import datetime, timedelta
 
 import jwt
 from flask import current_app
+from sqlalchemy import DDL, event
 from marshmallow import Schema, fields, validate, validates, ValidationError
-from werkzeug.security import generate_password_hash, check_password_hash
 
 from library_app import db
+from library_app.hashing import get_password_hasher
+from library_app.search import enable_full_text_search
+from library_app.suggest import enable_name_suggestions
 
 
 class Author(db.Model):
     __tablename__ = 'authors'
 
     id = db.Column(db.Integer, primary_key=True)
-    first_name = db.Column(db.String(50), nullable=False)
-    last_name = db.Column(db.String(50), nullable=False)
-    birth_date = db.Column(db.Date, nullable=False)
+    first_name = db.Column(db.String(50), nullable=False, index=True)
+    last_name = db.Column(db.String(50), nullable=False, index=True)
+    birth_date = db.Column(db.Date, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           info={'internal': True})
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, index=True, info={'internal': True})
     books = db.relationship('Book', back_populates='author',
-                            cascade='all, delete-orphan')
+                            cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<{self.__class__.__name__}>: {self.first_name} {self.last_name}'
 
-    @staticmethod
-    def additional_validation(param: str, value: str) -> date:
-        if param == 'birth_date':
-            try:
-                value = datetime.strptime(value, '%d-%m-%Y').date()
-            except ValueError:
-                value = None
-        return value
+
+enable_name_suggestions(Author.__table__, 'first_name', 'last_name')
 
 
 class Book(db.Model):
     __tablename__ = 'books'
 
     id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(50), nullable=False)
+    title = db.Column(db.String(50), nullable=False, index=True)
     isbn = db.Column(db.BigInteger, nullable=False, unique=True)
-    number_of_pages = db.Column(db.Integer, nullable=False)
+    number_of_pages = db.Column(db.Integer, nullable=False, index=True)
     description = db.Column(db.Text)
-    author_id = db.Column(db.Integer, db.ForeignKey('authors.id'),
-                          nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('authors.id', ondelete='CASCADE'),
+                          nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           info={'internal': True})
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, index=True, info={'internal': True})
     author = db.relationship('Author', back_populates='books')
 
     def __repr__(self):
         return f'{self.title} - {self.author.first_name} {self.author.last_name}'
 
-    @staticmethod
-    def additional_validation(param: str, value: str) -> str:
-        return value
+
+enable_full_text_search(Book.__table__, [('title', 'A'), ('description', 'B')])
+
+
+class DeletedRecord(db.Model):
+    __tablename__ = 'deleted_records'
+    __table_args__ = (
+        db.Index('ix_deleted_records_deleted_at_id', 'deleted_at', 'id'),
+        db.Index('ix_deleted_records_table_name_id', 'table_name', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def record(cls, model, *criterion) -> None:
+        """Insert tombstones for the records of the model matching the criterion.
+
+        Must run before the records are deleted; it is a single
+        ``INSERT ... SELECT`` statement and does not load the records.
+        """
+        records = db.select(
+            db.literal(model.__tablename__), model.id, db.literal(datetime.utcnow())
+        ).where(*criterion)
+        db.session.execute(
+            db.insert(cls.__table__).from_select(['table_name', 'record_id', 'deleted_at'], records)
+        )
+
+
+class TableVersion(db.Model):
+    """Write counter of a table, incremented by every transaction writing to the table.
+
+    The increment locks the row until commit, so versions follow commit
+    order, unlike ``updated_at`` timestamps.
+    """
+    __tablename__ = 'table_versions'
+
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+event.listen(TableVersion.__table__, 'after_create', DDL(
+    "INSERT INTO table_versions (table_name, version) VALUES ('authors', 0), ('books', 0)"
+))
 
 
 class User(db.Model):
@@ -59,23 +110,93 @@ class User(db.Model):
     email = db.Column(db.String(255), nullable=False, unique=True)
     password = db.Column(db.String(255), nullable=False)
     creation_date = db.Column(db.DateTime, default=datetime.utcnow)
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     @staticmethod
     def generate_hashed_password(password: str) -> str:
-        return generate_password_hash(password)
+        return get_password_hasher().hash(password)
 
     def is_password_valid(self, password: str) -> bool:
-        return check_password_hash(self.password, password)
+        return get_password_hasher().verify(self.password, password)
+
+    def rehash_password_if_needed(self, password: str) -> None:
+        """Rehash a valid password stored with outdated hashing parameters."""
+        if get_password_hasher().needs_rehash(self.password):
+            self.password = self.generate_hashed_password(password)
+
+    def invalidate_tokens(self) -> None:
+        """Make access tokens issued before this change fail verification."""
+        self.token_version = (self.token_version or 0) + 1
 
     def generate_jwt(self) -> str:
         payload = {
             'user_id': self.id,
+            'jti': uuid.uuid4().hex,
+            'token_version': self.token_version or 0,
+            'identity': user_schema.dump(self),
             'exp': datetime.utcnow() + timedelta(
                 minutes=current_app.config.get('JWT_EXPIRED_MINUTES', 30)
             )
         }
         return jwt.encode(payload, current_app.config.get('SECRET_KEY'))
 
+    def generate_refresh_token(self) -> str:
+        return RefreshToken.issue(self)
+
+
+class RefreshToken(db.Model):
+    __tablename__ = 'refresh_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    revoked_at = db.Column(db.DateTime)
+    creation_date = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User')
+
+    @staticmethod
+    def hash_token(token: str) -> str:
+        # refresh tokens are random, so a fast hash is enough to avoid storing them in plain text
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, user: 'User') -> str:
+        token = secrets.token_urlsafe(32)
+        refresh_token = cls(
+            user=user,
+            token_hash=cls.hash_token(token),
+            expires_at=datetime.utcnow() + timedelta(
+                days=current_app.config.get('REFRESH_TOKEN_EXPIRED_DAYS', 30)
+            )
+        )
+        db.session.add(refresh_token)
+        return token
+
+    def revoke(self) -> bool:
+        """Revoke the token unless it has already been revoked (e.g. by a concurrent refresh)."""
+        revoked = RefreshToken.query \
+            .filter(RefreshToken.id == self.id, RefreshToken.revoked_at.is_(None)) \
+            .update({'revoked_at': datetime.utcnow()}, synchronize_session=False)
+        return revoked == 1
+
+    @classmethod
+    def revoke_all(cls, user_id: int) -> None:
+        # refresh tokens are not in the entity cache, so there is nothing to invalidate
+        cls.query \
+            .filter(cls.user_id == user_id, cls.revoked_at.is_(None)) \
+            .update({'revoked_at': datetime.utcnow()}, synchronize_session=False)
+
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(32), nullable=False, unique=True, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
 
 class AuthorSchema(Schema):
     id = fields.Integer(dump_only=True)
@@ -133,7 +254,12 @@ class UserPasswordUpdateSchema(Schema):
                                  validate=validate.Length(min=6, max=255))
 
 
+class RefreshTokenSchema(Schema):
+    refresh_token = fields.String(required=True, load_only=True)
+
+
 author_schema = AuthorSchema()
 book_schema = BookSchema()
 user_schema = UserSchema()
 user_password_update_schema = UserPasswordUpdateSchema()
+refresh_token_schema = RefreshTokenSchema()
@@ -0,0 +1,140 @@
+import operator
+import re
+from collections import OrderedDict
+from datetime import date, datetime
+from threading import Lock
+from typing import Callable, Dict, NamedTuple, Tuple
+
+from flask import abort
+from sqlalchemy import Column
+from sqlalchemy.orm import InstrumentedAttribute
+
+# same format as the date fields of the schemas
+DATE_FORMAT = '%d-%m-%Y'
+FILTER_OPERATORS = {
+    '==': operator.eq,
+    'gte': operator.ge,
+    'gt': operator.gt,
+    'lte': operator.le,
+    'lt': operator.lt,
+    'in': lambda column_attr, values: column_attr.in_(values)
+}
+MAX_IN_VALUES = 100
+FILTER_PARAM_RE = re.compile(r'(\w+)(?:\[(\w+)\])?')
+
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+def get_coercer(column: Column) -> Callable[[str], object]:
+    """Return the function converting a query string value to the type of the column."""
+    python_type = column.type.python_type
+    if python_type is date:
+        return _parse_date
+    if python_type is datetime:
+        return datetime.fromisoformat
+    return python_type
+
+
+def get_list_coercer(coerce: Callable[[str], object]) -> Callable[[str], list]:
+    """Return the function converting comma separated values with ``coerce``."""
+
+    def coerce_list(value: str) -> list:
+        values = [coerce(item) for item in value.split(',')]
+        if len(values) > MAX_IN_VALUES:
+            raise ValueError(f'At most {MAX_IN_VALUES} values are allowed')
+        return values
+
+    return coerce_list
+
+
+class FilterStep(NamedTuple):
+    param: str
+    column_name: str
+    operator_name: str
+    column_attr: InstrumentedAttribute
+    compare: Callable
+    coerce: Callable[[str], object]
+
+
+class QueryPlan(NamedTuple):
+    filters: Tuple[FilterStep, ...]
+    sort_keys: Tuple[Tuple[InstrumentedAttribute, bool], ...]
+    order_by: tuple
+
+
+class QuerySpec:
+    """Filterable and sortable columns of a model with their coercers, compiled once.
+
+    Plans are compiled per signature, i.e. the sorted filter parameter names
+    and the sort parameter, and kept in a bounded LRU, so turning the query
+    string of a list request into filters and ordering is a dictionary lookup
+    followed by one coercion and one comparison per filter.
+    """
+
+    def __init__(self, model, max_plans: int = 256):
+        self.model = model
+        self.max_plans = max_plans
+        self.columns: Dict[str, Tuple[InstrumentedAttribute, Callable]] = {
+            column.key: (getattr(model, column.key), get_coercer(column))
+            for column in model.__table__.columns
+        }
+        self._plans = OrderedDict()
+        self._lock = Lock()
+
+    def get_plan(self, filter_params: Tuple[str, ...], sort: str) -> QueryPlan:
+        key = (filter_params, sort)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+
+        plan = QueryPlan(self._compile_filters(filter_params), *self._compile_sort(sort))
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def _compile_filters(self, filter_params: Tuple[str, ...]) -> Tuple[FilterStep, ...]:
+        filters = []
+        for param in filter_params:
+            match = FILTER_PARAM_RE.fullmatch(param)
+            column_name, operator_name = match.groups() if match is not None else (param, None)
+            operator_name = operator_name or '=='
+            if column_name not in self.columns or operator_name not in FILTER_OPERATORS:
+                abort(400, description=f'Unknown filter: {param}')
+            column_attr, coerce = self.columns[column_name]
+            if operator_name == 'in':
+                coerce = get_list_coercer(coerce)
+            filters.append(FilterStep(param, column_name, operator_name, column_attr,
+                                      FILTER_OPERATORS[operator_name], coerce))
+        return tuple(filters)
+
+    def _compile_sort(self, sort: str) -> Tuple[tuple, tuple]:
+        sort_keys = []
+        for key in filter(None, sort.split(',')):
+            desc = key.startswith('-')
+            column_name = key[1:] if desc else key
+            if column_name not in self.columns:
+                abort(400, description=f'Unknown sort field: {column_name}')
+            sort_keys.append((self.columns[column_name][0], desc))
+        order_by = tuple(column_attr.desc() if desc else column_attr for column_attr, desc in sort_keys)
+        return tuple(sort_keys), order_by
+
+
+_query_specs: Dict[type, QuerySpec] = {}
+
+
+def compile_query_specs(*models) -> None:
+    for model in models:
+        _query_specs[model] = QuerySpec(model)
+
+
+def get_query_spec(model) -> QuerySpec:
+    query_spec = _query_specs.get(model)
+    if query_spec is None:
+        query_spec = _query_specs.setdefault(model, QuerySpec(model))
+    return query_spec
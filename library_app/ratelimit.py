@@ -0,0 +1,119 @@
+import math
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from typing import Optional
+
+from flask import current_app, request, abort
+
+
+class TokenBucketLimiter:
+    """In-process token buckets, one per key, refilled at ``rate`` tokens per second.
+
+    Only the ``max_keys`` most recently used buckets are kept; an evicted
+    bucket starts again full.
+    """
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def consume(self, key: str, capacity: int, rate: float) -> Optional[float]:
+        """Take one token from the bucket, returning the seconds to wait when it is empty."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            retry_after = None
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return retry_after
+
+
+class RedisTokenBucketLimiter:
+    """Token buckets shared between workers, stored in Redis (requires the ``redis`` package)."""
+
+    SCRIPT = """
+        local capacity = tonumber(ARGV[1])
+        local rate = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated_at = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+        local retry_after = -1
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            retry_after = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+        return tostring(retry_after)
+    """
+
+    def __init__(self, url: str, prefix: str = 'library:ratelimit:'):
+        try:
+            import redis
+        except ImportError as error:
+            raise RuntimeError('The redis package is required for the redis rate limit backend') from error
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def consume(self, key: str, capacity: int, rate: float) -> Optional[float]:
+        retry_after = float(self._script(keys=[self.prefix + key], args=[capacity, rate, time.time()]))
+        return retry_after if retry_after >= 0 else None
+
+
+def create_limiter(config: dict):
+    limiter_type = config.get('AUTH_RATE_LIMIT_TYPE')
+    if limiter_type == 'memory':
+        return TokenBucketLimiter(config.get('AUTH_RATE_LIMIT_MAX_KEYS', 10000))
+    if limiter_type == 'redis':
+        return RedisTokenBucketLimiter(config.get('AUTH_RATE_LIMIT_REDIS_URL'))
+    return None
+
+
+def get_auth_limiter():
+    if 'auth_limiter' not in current_app.extensions:
+        current_app.extensions.setdefault('auth_limiter', create_limiter(current_app.config))
+    return current_app.extensions['auth_limiter']
+
+
+def _consume(limiter, key: str, limit: tuple) -> None:
+    capacity, per_seconds = limit
+    retry_after = limiter.consume(key, capacity, capacity / per_seconds)
+    if retry_after is not None:
+        abort(429, description='Too many requests. Please try again later',
+              retry_after=math.ceil(retry_after))
+
+
+def auth_rate_limited(func):
+    """Reject bursts of requests from one client IP or for one username with 429.
+
+    Runs before the request body is validated so that rejected requests
+    never reach password hashing.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        limiter = get_auth_limiter()
+        if limiter is not None:
+            _consume(limiter, f'ip:{request.remote_addr}', current_app.config['AUTH_RATE_LIMIT_PER_IP'])
+            data = request.get_json(silent=True)
+            username = data.get('username') if isinstance(data, dict) else None
+            if isinstance(username, str):
+                _consume(limiter, f'username:{username.lower()}',
+                         current_app.config['AUTH_RATE_LIMIT_PER_USERNAME'])
+        return func(*args, **kwargs)
+
+    return wrapper
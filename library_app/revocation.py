@@ -0,0 +1,116 @@
+import hashlib
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+
+from flask import current_app
+
+from library_app import db
+from library_app.models import RevokedToken
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives."""
+
+    def __init__(self, size: int = 2 ** 20, hash_count: int = 7):
+        self.size = size
+        self.hash_count = hash_count
+        self._bits = bytearray((size + 7) // 8)
+
+    def _get_positions(self, item: str):
+        digest = hashlib.sha256(item.encode()).digest()
+        first_hash = int.from_bytes(digest[:8], 'big')
+        second_hash = int.from_bytes(digest[8:16], 'big') | 1
+        for index in range(self.hash_count):
+            yield (first_hash + index * second_hash) % self.size
+
+    def add(self, item: str) -> None:
+        for position in self._get_positions(item):
+            self._bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position // 8] & (1 << (position % 8))
+                   for position in self._get_positions(item))
+
+
+class RevocationList:
+    """Revoked token ids (``jti``) fronted by an in-process Bloom filter.
+
+    The filter is refreshed with tokens revoked by other processes at most
+    every ``REVOCATION_REFRESH_SECONDS``. Each refresh re-reads the tokens
+    revoked since the previous one started minus
+    ``REVOCATION_SETTLE_SECONDS``, so that revocations committed late by
+    transactions still in flight are not missed. Every ``REVOCATION_PRUNE_SECONDS`` expired tokens are deleted and
+    the filter is rebuilt from the remaining ones. Only tokens the filter
+    reports as possibly revoked are looked up in the database.
+    """
+
+    def __init__(self, size: int, hash_count: int, refresh_seconds: float, settle_seconds: float = 5,
+                 prune_seconds: float = 3600):
+        self.bloom_filter = BloomFilter(size, hash_count)
+        self.refresh_seconds = refresh_seconds
+        self.settle_seconds = settle_seconds
+        self.prune_seconds = prune_seconds
+        self._since = None
+        self._revoked_jtis = []
+        self._refreshed_at = None
+        self._pruned_at = None
+        self._lock = Lock()
+
+    def refresh(self) -> None:
+        if self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if self._pruned_at is None or time.monotonic() - self._pruned_at >= self.prune_seconds:
+                self._rebuild()
+            else:
+                self._load_revoked_since()
+            self._refreshed_at = time.monotonic()
+
+    def _load_revoked_since(self) -> None:
+        started_at = datetime.utcnow()
+        jtis = db.session.query(RevokedToken.jti).filter(RevokedToken.revoked_at >= self._since)
+        for jti, in jtis:
+            self.bloom_filter.add(jti)
+        self._since = started_at - timedelta(seconds=self.settle_seconds)
+
+    def _rebuild(self) -> None:
+        started_at = datetime.utcnow()
+        # a separate transaction, as the request may still change the session
+        with db.engine.begin() as connection:
+            connection.execute(RevokedToken.__table__.delete().where(RevokedToken.expires_at <= started_at))
+        bloom_filter = BloomFilter(self.bloom_filter.size, self.bloom_filter.hash_count)
+        for jti, in db.session.query(RevokedToken.jti):
+            bloom_filter.add(jti)
+        # tokens revoked by this process may not have been committed yet
+        for jti in self._revoked_jtis:
+            bloom_filter.add(jti)
+        self._revoked_jtis = []
+        self.bloom_filter = bloom_filter
+        self._since = started_at - timedelta(seconds=self.settle_seconds)
+        self._pruned_at = time.monotonic()
+
+    def is_revoked(self, jti: str) -> bool:
+        self.refresh()
+        if jti not in self.bloom_filter:
+            return False
+        return db.session.query(RevokedToken.id).filter(RevokedToken.jti == jti).first() is not None
+
+    def revoke(self, jti: str, expires_at) -> None:
+        db.session.add(RevokedToken(jti=jti, expires_at=expires_at))
+        with self._lock:
+            self.bloom_filter.add(jti)
+            self._revoked_jtis.append(jti)
+
+
+def get_revocation_list() -> RevocationList:
+    revocation_list = current_app.extensions.get('revocation_list')
+    if revocation_list is None:
+        revocation_list = current_app.extensions.setdefault('revocation_list', RevocationList(
+            current_app.config.get('REVOCATION_BLOOM_SIZE', 2 ** 20),
+            current_app.config.get('REVOCATION_BLOOM_HASHES', 7),
+            current_app.config.get('REVOCATION_REFRESH_SECONDS', 5),
+            current_app.config.get('REVOCATION_SETTLE_SECONDS', 5),
+            current_app.config.get('REVOCATION_PRUNE_SECONDS', 3600)
+        ))
+    return revocation_list
@@ -0,0 +1,92 @@
+import re
+from typing import List, Tuple
+
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import DDL, Table, event, func, literal_column, false, table, column, select
+
+from library_app import db
+
+SEARCH_CONFIG = 'english'
+# same relative weights as PostgreSQL ts_rank uses for the A-D labels
+RANK_WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+SEARCH_TERM_RE = re.compile(r'\w+')
+
+
+def _get_search_vector_expression(columns: List[Tuple[str, str]]) -> str:
+    return ' || '.join(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({name}, '')), '{weight}')"
+        for name, weight in columns
+    )
+
+
+def _get_fts_statements(table_name: str, columns: List[Tuple[str, str]]) -> List[str]:
+    search_table = f'{table_name}_search'
+    names = ', '.join(name for name, _ in columns)
+    new_values = ', '.join(f'new.{name}' for name, _ in columns)
+    old_values = ', '.join(f'old.{name}' for name, _ in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {search_table} USING fts5("
+        f"{names}, content='{table_name}', content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {search_table}_ai AFTER INSERT ON {table_name} BEGIN "
+        f"INSERT INTO {search_table}(rowid, {names}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {search_table}_ad AFTER DELETE ON {table_name} BEGIN "
+        f"INSERT INTO {search_table}({search_table}, rowid, {names}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {search_table}_au AFTER UPDATE ON {table_name} BEGIN "
+        f"INSERT INTO {search_table}({search_table}, rowid, {names}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {search_table}(rowid, {names}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+def enable_full_text_search(target: Table, columns: List[Tuple[str, str]]) -> None:
+    """Make the table searchable with :func:`apply_search` once created with ``create_all``.
+
+    ``columns`` are ``(column name, weight label A-D)`` pairs. PostgreSQL gets a
+    generated ``search_vector`` column with a GIN index, SQLite an FTS5 table
+    ``<table>_search`` kept in sync with the table by triggers. Existing
+    databases get the same objects from migrations.
+    """
+    table_name = target.name
+    target.info['search_columns'] = columns
+
+    event.listen(target, 'after_create', DDL(
+        f'ALTER TABLE {table_name} ADD COLUMN search_vector tsvector '
+        f'GENERATED ALWAYS AS ({_get_search_vector_expression(columns)}) STORED'
+    ).execute_if(dialect='postgresql'))
+    event.listen(target, 'after_create', DDL(
+        f'CREATE INDEX ix_{table_name}_search_vector ON {table_name} USING GIN (search_vector)'
+    ).execute_if(dialect='postgresql'))
+
+    for statement in _get_fts_statements(table_name, columns):
+        event.listen(target, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(target, 'before_drop', DDL(
+        f'DROP TABLE IF EXISTS {table_name}_search'
+    ).execute_if(dialect='sqlite'))
+
+
+def apply_search(model, query: BaseQuery, terms: str) -> BaseQuery:
+    """Keep the records matching all words of ``terms``, best matches first."""
+    table_name = model.__table__.name
+
+    if db.engine.dialect.name == 'postgresql':
+        search_vector = literal_column(f'{table_name}.search_vector')
+        ts_query = func.plainto_tsquery(SEARCH_CONFIG, terms)
+        return query \
+            .filter(search_vector.op('@@')(ts_query)) \
+            .order_by(func.ts_rank(search_vector, ts_query).desc(), model.id)
+
+    words = SEARCH_TERM_RE.findall(terms)
+    if not words:
+        return query.filter(false())
+
+    search_table = table(f'{table_name}_search', column('rowid'))
+    # bm25 is lower for better matches and is only available in a query on the FTS5 table itself
+    rank = func.bm25(literal_column(search_table.name), *(
+        literal_column(repr(RANK_WEIGHTS[weight])) for _, weight in model.__table__.info['search_columns']
+    ))
+    # words are quoted to disable the FTS5 query syntax
+    matches = select(search_table.c.rowid, rank.label('rank')) \
+        .where(literal_column(search_table.name).op('MATCH')(' '.join(f'"{word}"' for word in words))) \
+        .subquery()
+    return query \
+        .join(matches, matches.c.rowid == model.id) \
+        .order_by(matches.c.rank, model.id)
@@ -0,0 +1,134 @@
+from bisect import bisect_left
+from threading import Lock, Thread
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import Column, DDL, Table, and_, event, func, literal_column
+from sqlalchemy.sql.elements import ColumnElement
+
+from library_app import db
+
+
+class PrefixIndex:
+    """Sorted array of lowercased keys for case-insensitive prefix lookups.
+
+    ``load`` returns ``(record id, record, keys)`` triples; a record is found
+    by a prefix of any of its keys. :meth:`refresh` compares the version of
+    the underlying table with the version the index was built from and
+    rebuilds a stale index in a background thread, so requests never wait
+    for a build. The new snapshot replaces the previous one once complete.
+    """
+
+    def __init__(self, load: Callable[[], Iterable[Tuple[int, dict, Iterable[str]]]]):
+        self._load = load
+        self._snapshot = ([], [], {})
+        self._lock = Lock()
+        self._rebuilding = False
+        self._thread = None
+        self.version = None
+
+    def refresh(self, version: str) -> bool:
+        """Start a rebuild unless the index is built from ``version``, and tell whether it is."""
+        if version == self.version:
+            return True
+        with self._lock:
+            if self._rebuilding:
+                return False
+            self._rebuilding = True
+            self._thread = Thread(target=self._rebuild, args=(current_app._get_current_object(), version),
+                                  daemon=True)
+            self._thread.start()
+        return False
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Wait for the running rebuild, if any, to complete."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _rebuild(self, app, version: str) -> None:
+        try:
+            with app.app_context():
+                self._build()
+            # the records were read after the version, so the snapshot is at least that recent
+            self.version = version
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _build(self) -> None:
+        entries = []
+        records = {}
+        for record_id, record, keys in self._load():
+            records[record_id] = record
+            entries.extend((key.lower(), record_id) for key in keys)
+        entries.sort()
+        self._snapshot = ([key for key, _ in entries], [record_id for _, record_id in entries], records)
+
+    def search(self, prefix: str, limit: int) -> List[dict]:
+        keys, record_ids, records = self._snapshot
+        prefix = prefix.lower()
+        results = []
+        seen = set()
+        for position in range(bisect_left(keys, prefix), len(keys)):
+            if len(results) >= limit or not keys[position].startswith(prefix):
+                break
+            record_id = record_ids[position]
+            if record_id not in seen:
+                seen.add(record_id)
+                results.append(records[record_id])
+        return results
+
+
+def get_prefix_index(table: str, load: Callable, version: str) -> Optional[PrefixIndex]:
+    """Return the prefix index of the table when it is built from ``version``.
+
+    ``version`` is read from the database (e.g. with ``get_tables_version``),
+    so writes of other processes are noticed as well. Returns ``None`` while
+    the index is (re)built in the background; callers then query the
+    database instead of serving an outdated snapshot.
+    """
+    prefix_index = current_app.extensions.get(f'prefix_index:{table}')
+    if prefix_index is None:
+        prefix_index = current_app.extensions.setdefault(f'prefix_index:{table}', PrefixIndex(load))
+    return prefix_index if prefix_index.refresh(version) else None
+
+
+def get_name_keys(first_name: Column, last_name: Column) -> List[ColumnElement]:
+    """Return the lowercased first, last and full name, as indexed by :func:`enable_name_suggestions`.
+
+    On PostgreSQL the keys use the "C" collation: its byte order lets the
+    same index serve prefix ranges and ``ORDER BY``.
+    """
+    keys = [func.lower(first_name), func.lower(last_name),
+            func.lower(first_name + literal_column("' '") + last_name)]
+    if db.engine.dialect.name == 'postgresql':
+        keys = [key.collate('C') for key in keys]
+    return keys
+
+
+def prefix_range(key: ColumnElement, prefix: str) -> ColumnElement:
+    """Condition on ``key`` starting with ``prefix``, as a range an index on ``key`` can scan."""
+    return and_(key >= prefix, key < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def enable_name_suggestions(target: Table, first_name: str, last_name: str) -> None:
+    """Create the indexes used for name suggestions with ``create_all``.
+
+    Prefixes are matched and ordered with indexes on the lowercased first,
+    last and full names (in the "C" collation on PostgreSQL), similar names
+    with a PostgreSQL trigram index on the lowercased full name. Existing
+    databases get the same indexes from migrations.
+    """
+    table_name = target.name
+    full_name = f"{first_name} || ' ' || {last_name}"
+    for dialect, collation in (('postgresql', ' COLLATE "C"'), ('sqlite', '')):
+        for name, expression in ((first_name, first_name), (last_name, last_name), ('full_name', full_name)):
+            event.listen(target, 'after_create', DDL(
+                f'CREATE INDEX ix_{table_name}_{name}_lower ON {table_name} ((lower({expression}){collation}))'
+            ).execute_if(dialect=dialect))
+    for statement in (
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        f'CREATE INDEX ix_{table_name}_full_name_trgm ON {table_name} USING GIN (lower({full_name}) gin_trgm_ops)',
+    ):
+        event.listen(target, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
@@ -1,15 +1,40 @@
-import re
+import base64
+import binascii
+import csv
+import hashlib
+import io
+import json
+import math
+from contextlib import contextmanager
+from datetime import date, datetime
 from functools import wraps
-from typing import Tuple
+from itertools import islice
+from typing import Tuple, List, Optional, Callable
 
 import jwt
-from flask import request, url_for, current_app, abort
-from flask_sqlalchemy import DefaultMeta, BaseQuery
-from sqlalchemy.orm import InstrumentedAttribute
-from sqlalchemy.sql.elements import BinaryExpression
+from flask import request, url_for, current_app, abort, Response, stream_with_context, make_response, g
+from marshmallow import Schema
+from flask_sqlalchemy import DefaultMeta, BaseQuery, Pagination
+from sqlalchemy import and_, or_, func, select, false
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import InstrumentedAttribute, selectinload, joinedload, load_only
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.sql.elements import BooleanClauseList
 from werkzeug.exceptions import UnsupportedMediaType
 
-COMPARISON_OPERATORS_RE = re.compile(r'(.*)\[(gte|gt|lte|lt)\]')
+from library_app import db, entity_cache
+from library_app.advisor import note_query_shape
+from library_app.query_spec import QueryPlan, get_query_spec
+from library_app.cache import get_token_cache, LRUCacheBackend, invalidate_on_commit
+from library_app.revocation import get_revocation_list
+from library_app.models import TableVersion
+
+RESERVED_PARAMS = {'fields', 'sort', 'page', 'limit', 'cursor', 'count', 'include', 'format', 'q'}
+COUNT_MODES = {'exact', 'estimate', 'none'}
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
 
 
 def validate_json_content_type(func):
@@ -34,89 +59,478 @@ def token_required(func):
         if token is None:
             abort(401, description='Missing token. Please login or register')
 
-        try:
-            payload = jwt.decode(token, current_app.config.get('SECRET_KEY'), algorithms="HS256")
-        except jwt.ExpiredSignatureError:
-            abort(401, description='Expired token. Please login to get new token')
-        except jwt.InvalidTokenError:
-            abort(401, description='Invalid token. Please login or register')
-        else:
-            return func(payload['user_id'], *args, **kwargs)
+        token_cache = get_token_cache()
+        payload = token_cache.get(token) if token_cache is not None else None
+        if payload is None:
+            try:
+                payload = jwt.decode(token, current_app.config.get('SECRET_KEY'), algorithms="HS256")
+            except jwt.ExpiredSignatureError:
+                abort(401, description='Expired token. Please login to get new token')
+            except jwt.InvalidTokenError:
+                abort(401, description='Invalid token. Please login or register')
+            if token_cache is not None:
+                token_cache.set(token, payload)
+
+        if 'jti' in payload and get_revocation_list().is_revoked(payload['jti']):
+            abort(401, description='Revoked token. Please login to get new token')
+        if 'token_version' in payload:
+            current = entity_cache.get_or_load('token_versions', payload['user_id'])
+            if current is None or current['token_version'] != payload['token_version']:
+                abort(401, description='Outdated token. Please login to get new token')
+
+        g.token_payload = payload
+        return func(payload['user_id'], *args, **kwargs)
     return wrapper
 
 
+def conditional(get_version: Callable[..., Optional[str]]):
+    """Support conditional GET with strong ETags derived from a record version.
+
+    ``get_version`` receives the view arguments and returns a string that
+    changes whenever the response would change, or ``None`` to let the view
+    handle a missing record. A matching ``If-None-Match`` is answered with 304
+    before the view runs.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            version = get_version(**kwargs)
+            if version is None:
+                return func(*args, **kwargs)
+
+            args_signature = sorted(request.args.items(multi=True))
+            etag = hashlib.sha1(f'{request.endpoint}:{version}:{args_signature}'.encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+
+            # lets the view serve cached data only when it belongs to this version
+            g.resource_version = version
+            response = make_response(func(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def get_tables_version(*models) -> str:
+    """Version of whole tables, from their write counters in ``table_versions``."""
+    table_names = [model.__tablename__ for model in models]
+    versions = dict(
+        db.session.query(TableVersion.table_name, TableVersion.version)
+        .filter(TableVersion.table_name.in_(table_names))
+        .all()
+    )
+    return ':'.join(str(versions.get(table_name)) for table_name in table_names)
+
+
+def _get_violated_constraint(error: IntegrityError) -> str:
+    diag = getattr(error.orig, 'diag', None)
+    return getattr(diag, 'constraint_name', None) or str(error.orig)
+
+
+@contextmanager
+def handle_conflicts(conflict_messages: dict):
+    """Map unique constraint violations raised inside the block to 409 errors.
+
+    ``conflict_messages`` maps unique column names to the error description
+    returned when the constraint on that column is violated.
+    """
+    try:
+        yield
+    except IntegrityError as error:
+        db.session.rollback()
+        constraint = _get_violated_constraint(error)
+        for column, message in conflict_messages.items():
+            if column in constraint:
+                abort(409, description=message)
+        raise
+
+
+def commit_or_conflict(conflict_messages: dict) -> None:
+    with handle_conflicts(conflict_messages):
+        db.session.commit()
+
+
+def update_returning(model, record_id: int, values: dict) -> Optional[RowMapping]:
+    """Update a single record without loading it and return its new column values.
+
+    On databases supporting ``UPDATE ... RETURNING`` this is a single
+    statement. Otherwise the row is selected after the update, and only when
+    the update actually matched a record.
+    """
+    table = model.__table__
+    # the parents it belonged to are invalidated as dependents of the record, the new ones by the written key
+    invalidate_on_commit(db.session, (table.name, record_id), *(
+        (foreign_key.column.table.name, values[foreign_key.parent.key])
+        for foreign_key in table.foreign_keys if values.get(foreign_key.parent.key) is not None
+    ))
+    statement = table.update().where(table.c.id == record_id).values(**values)
+    if db.engine.dialect.full_returning:
+        row = db.session.execute(statement.returning(*table.columns)).first()
+        return row._mapping if row is not None else None
+
+    if db.session.execute(statement).rowcount == 0:
+        return None
+    return db.session.execute(select(table).where(table.c.id == record_id)).first()._mapping
+
+
+def _get_included_relationships(model) -> list:
+    relationships = model.__mapper__.relationships.keys()
+    include = request.args.get('include')
+    if include is None:
+        return relationships
+    return [name for name in include.split(',') if name in relationships]
+
+
+def _get_requested_fields(model) -> list:
+    fields = request.args.get('fields')
+    if not fields:
+        return []
+    columns = model.__table__.columns
+    return [
+        field for field in fields.split(',')
+        if field in columns and not columns[field].info.get('internal')
+    ]
+
+
 def get_schema_args(model) -> dict:
     schema_args = {'many': True}
-    fields = request.args.get('fields')
-    if fields:
-        schema_args['only'] = (
-            [field for field in fields.split(',') if field in model.__table__.columns]
+    if request.args.get('fields'):
+        schema_args['only'] = _get_requested_fields(model)
+    else:
+        included = _get_included_relationships(model)
+        schema_args['exclude'] = (
+            [name for name in model.__mapper__.relationships.keys() if name not in included]
         )
     return schema_args
 
 
-def apply_order(model, query: BaseQuery) -> BaseQuery:
-    sort_keys = request.args.get('sort')
-    if sort_keys:
-        for key in sort_keys.split(','):
-            desc = False
-            if key.startswith('-'):
-                key = key[1:]
-                desc = True
-            column_attr = getattr(model, key, None)
-            if column_attr is not None:
-                if desc:
-                    query = query.order_by(column_attr.desc())
-                else:
-                    query = query.order_by(column_attr)
+def apply_projection(model, query: BaseQuery) -> BaseQuery:
+    fields = _get_requested_fields(model)
+    if fields:
+        columns = set(fields) | {column_attr.key for column_attr, _ in _get_sort_keys(model)}
+        query = query.options(load_only(*[getattr(model, column) for column in columns]))
     return query
 
 
-def _get_filter_argument(
-        column_name: InstrumentedAttribute, value: str, operator: str
-) -> BinaryExpression:
-    operator_mapping = {
-        '==': column_name == value,
-        'gte': column_name >= value,
-        'gt': column_name > value,
-        'lte': column_name <= value,
-        'lt': column_name < value
-    }
-    return operator_mapping[operator]
+def apply_include(model, query: BaseQuery) -> BaseQuery:
+    if request.args.get('fields'):
+        return query
+    for name in _get_included_relationships(model):
+        if model.__mapper__.relationships[name].uselist:
+            query = query.options(selectinload(getattr(model, name)))
+        else:
+            query = query.options(joinedload(getattr(model, name)))
+    return query
+
+
+def _get_query_plan(model) -> QueryPlan:
+    filter_params = tuple(sorted(param for param in request.args if param not in RESERVED_PARAMS))
+    return get_query_spec(model).get_plan(filter_params, request.args.get('sort', ''))
+
+
+def _get_sort_keys(model) -> List[Tuple[InstrumentedAttribute, bool]]:
+    return list(_get_query_plan(model).sort_keys)
+
+
+def apply_order(model, query: BaseQuery) -> BaseQuery:
+    plan = _get_query_plan(model)
+    if plan.order_by:
+        query = query.order_by(*plan.order_by)
+    note_query_shape(model.__tablename__, sort=[f'{"-" if desc else ""}{column_attr.key}'
+                                                for column_attr, desc in plan.sort_keys])
+    return query
 
 
 def apply_filter(model, query: BaseQuery) -> BaseQuery:
-    for param, value in request.args.items():
-        if param not in {'fields', 'sort', 'page', 'limit'}:
-            operator = '=='
-            match = COMPARISON_OPERATORS_RE.match(param)
-            if match is not None:
-                param, operator = match.groups()
-            column_attr = getattr(model, param, None)
-            if column_attr is not None:
-                value = model.additional_validation(param, value)
-                if value is None:
-                    continue
-                filter_argument = _get_filter_argument(column_attr, value, operator)
-                query = query.filter(filter_argument)
+    plan = _get_query_plan(model)
+    for step in plan.filters:
+        value = request.args[step.param]
+        try:
+            value = step.coerce(value)
+        except (ValueError, TypeError):
+            abort(400, description=f'Invalid value of filter {step.param}: {value}')
+        query = query.filter(step.compare(step.column_attr, value))
+    note_query_shape(model.__tablename__, filters=[(step.column_name, step.operator_name) for step in plan.filters])
     return query
 
 
+def _encode_cursor(values: list, direction: str) -> str:
+    payload = json.dumps({'values': values, 'direction': direction}, default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def _decode_cursor(cursor: str, sort_keys: list) -> Tuple[list, str]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        values, direction = payload['values'], payload['direction']
+        if len(values) != len(sort_keys) or direction not in {'next', 'prev'}:
+            raise ValueError
+        values = [
+            _coerce_cursor_value(column_attr, value)
+            for (column_attr, _), value in zip(sort_keys, values)
+        ]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        abort(400, description='Invalid cursor')
+    return values, direction
+
+
+def _coerce_cursor_value(column_attr: InstrumentedAttribute, value):
+    if value is None:
+        return value
+    python_type = column_attr.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+def _is_nullable(column_attr: InstrumentedAttribute) -> bool:
+    return column_attr.property.columns[0].nullable
+
+
+def _order_key(column_attr: InstrumentedAttribute, desc: bool):
+    # NULLs sort as the lowest value on every database, which the seek conditions rely on
+    if not _is_nullable(column_attr):
+        return column_attr.desc() if desc else column_attr
+    return column_attr.desc().nullslast() if desc else column_attr.asc().nullsfirst()
+
+
+def _equal_condition(column_attr: InstrumentedAttribute, value):
+    return column_attr.is_(None) if value is None else column_attr == value
+
+
+def _after_condition(column_attr: InstrumentedAttribute, value):
+    return column_attr.isnot(None) if value is None else column_attr > value
+
+
+def _before_condition(column_attr: InstrumentedAttribute, value):
+    if value is None:
+        return false()
+    if _is_nullable(column_attr):
+        return or_(column_attr < value, column_attr.is_(None))
+    return column_attr < value
+
+
+def _get_seek_condition(sort_keys: list, values: list, direction: str) -> BooleanClauseList:
+    conditions = []
+    for index, (column_attr, desc) in enumerate(sort_keys):
+        equal_keys = [
+            _equal_condition(key_attr, value) for (key_attr, _), value in zip(sort_keys[:index], values)
+        ]
+        if desc == (direction == 'prev'):
+            conditions.append(and_(*equal_keys, _after_condition(column_attr, values[index])))
+        else:
+            conditions.append(and_(*equal_keys, _before_condition(column_attr, values[index])))
+    return or_(*conditions)
+
+
+def get_keyset_pagination(query: BaseQuery, func_name: str, limit: int) -> Tuple[list, dict]:
+    model = query.column_descriptions[0]['entity']
+    sort_keys = _get_sort_keys(model)
+    if not any(column_attr.key == 'id' for column_attr, _ in sort_keys):
+        sort_keys.append((model.id, False))
+
+    cursor = request.args.get('cursor')
+    direction = 'next'
+    query = query.order_by(None)
+    if cursor:
+        values, direction = _decode_cursor(cursor, sort_keys)
+        query = query.filter(_get_seek_condition(sort_keys, values, direction))
+
+    reverse = direction == 'prev'
+    for column_attr, desc in sort_keys:
+        query = query.order_by(_order_key(column_attr, desc != reverse))
+
+    items = query.limit(limit + 1).all()
+    has_more = len(items) > limit
+    items = items[:limit]
+    if reverse:
+        items.reverse()
+
+    params = {key: value for key, value in request.args.items() if key not in {'cursor', 'page'}}
+    pagination = {
+        'current_page': url_for(func_name, cursor=cursor, **params)
+    }
+
+    if items and (has_more or reverse):
+        values = [getattr(items[-1], column_attr.key) for column_attr, _ in sort_keys]
+        pagination['next_cursor'] = url_for(func_name, cursor=_encode_cursor(values, 'next'), **params)
+    if items and (has_more if reverse else bool(cursor)):
+        values = [getattr(items[0], column_attr.key) for column_attr, _ in sort_keys]
+        pagination['prev_cursor'] = url_for(func_name, cursor=_encode_cursor(values, 'prev'), **params)
+
+    return items, pagination
+
+
+def paginate_with_total(query: BaseQuery, page: int, per_page: int) -> Pagination:
+    """Fetch a page and the total number of records in a single statement.
+
+    The total is computed with ``COUNT(*) OVER()`` alongside the page rows.
+    When the page is empty (e.g. past the last page) there is no row to
+    carry the total, so a separate ``COUNT`` is issued as a fallback.
+    """
+    page = max(page, 1)
+    if per_page < 0:
+        per_page = 20
+
+    rows = (
+        query.add_columns(func.count().over().label('total'))
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+        .all()
+    )
+    if rows:
+        total = rows[0].total
+    elif page != 1 or per_page == 0:
+        total = query.order_by(None).count()
+    else:
+        total = 0
+
+    return Pagination(query, page, per_page, total, [row[0] for row in rows])
+
+
+def paginate_without_total(query: BaseQuery, page: int, per_page: int) -> Tuple[list, bool]:
+    """Fetch a page without counting, using one extra row to detect a next page."""
+    page = max(page, 1)
+    if per_page < 0:
+        per_page = 20
+
+    items = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return items[:per_page], len(items) > per_page
+
+
+def estimate_count(query: BaseQuery) -> int:
+    """Estimate the number of records matched by the query.
+
+    On PostgreSQL the row estimate of the planner (``EXPLAIN``) is used, which
+    is based on table statistics and never scans the table. Other databases
+    fall back to an exact count cached for ``COUNT_ESTIMATE_TIMEOUT`` seconds,
+    in an LRU of at most ``COUNT_ESTIMATE_MAX_SIZE`` queries.
+    """
+    statement = query.order_by(None).statement
+    # expanding IN parameters are rendered so the SQL and its parameters are complete
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+
+    if db.engine.dialect.name == 'postgresql':
+        result = db.session.connection().exec_driver_sql(
+            f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+        )
+        return int(result.scalar()[0]['Plan']['Plan Rows'])
+
+    cache = current_app.extensions.get('count_estimates')
+    if cache is None:
+        cache = current_app.extensions.setdefault('count_estimates', LRUCacheBackend(
+            current_app.config.get('COUNT_ESTIMATE_MAX_SIZE', 256),
+            current_app.config.get('COUNT_ESTIMATE_TIMEOUT', 60)
+        ))
+    key = (str(compiled), tuple(sorted(compiled.params.items(), key=str)))
+    total = cache.get(key)
+    if total is None:
+        total = query.order_by(None).count()
+        cache.set(key, total)
+    return total
+
+
 def get_pagination(query: BaseQuery, func_name: str) -> Tuple[list, dict]:
-    page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', current_app.config.get('PER_PAGE', 5), type=int)
+    if 'cursor' in request.args:
+        return get_keyset_pagination(query, func_name, limit)
+
+    count = request.args.get('count', 'exact')
+    if count not in COUNT_MODES:
+        abort(400, description=f'Count must be one of: {", ".join(sorted(COUNT_MODES))}')
+
+    page = request.args.get('page', 1, type=int)
     params = {key: value for key, value in request.args.items() if key != 'page'}
-    paginate_obj = query.paginate(page=page, per_page=limit, error_out=False)
+    pagination = {}
 
-    pagination = {
-        'total_pages': paginate_obj.pages,
-        'total_records': paginate_obj.total,
-        'current_page': url_for(func_name, page=page, **params)
-    }
+    if count == 'exact':
+        paginate_obj = paginate_with_total(query, page, limit)
+        items, has_next, has_prev = paginate_obj.items, paginate_obj.has_next, paginate_obj.has_prev
+        pagination['total_pages'] = paginate_obj.pages
+        pagination['total_records'] = paginate_obj.total
+    else:
+        items, has_next = paginate_without_total(query, page, limit)
+        has_prev = page > 1
+        if count == 'estimate':
+            total = estimate_count(query)
+            pagination['total_pages'] = math.ceil(total / limit) if limit > 0 else 0
+            pagination['total_records'] = total
+            pagination['estimated'] = True
+        else:
+            pagination['has_next'] = has_next
 
-    if paginate_obj.has_next:
+    pagination['current_page'] = url_for(func_name, page=page, **params)
+    if has_next:
         pagination['next_page'] = url_for(func_name, page=page + 1, **params)
-    if paginate_obj.has_prev:
+    if has_prev:
         pagination['previous_page'] = url_for(func_name, page=page - 1, **params)
 
-    return paginate_obj.items, pagination
+    return items, pagination
+
+
+def _iter_batches(query: BaseQuery, schema: Schema, batch_size: int):
+    rows = iter(query.yield_per(batch_size))
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield schema.dump(batch)
+
+
+def _generate_ndjson(batches):
+    for batch in batches:
+        yield ''.join(json.dumps(item) + '\n' for item in batch)
+
+
+def _generate_csv(batches, field_names: list):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=field_names)
+    writer.writeheader()
+    for batch in batches:
+        for item in batch:
+            writer.writerow({
+                key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                for key, value in item.items()
+            })
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def get_export_response(query: BaseQuery, schema: Schema, filename: str) -> Response:
+    """Stream every record matched by the query as NDJSON or CSV.
+
+    Records are fetched in batches of ``EXPORT_BATCH_SIZE`` with
+    ``yield_per`` (a server-side cursor on PostgreSQL), so memory usage does
+    not grow with the size of the result set.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        abort(400, description=f'Format must be one of: {", ".join(sorted(EXPORT_FORMATS))}')
+
+    # without a tie-breaker the row order would depend on the index the planner picks
+    model = query.column_descriptions[0]['entity']
+    query = query.order_by(model.id)
+
+    batches = _iter_batches(query, schema, current_app.config.get('EXPORT_BATCH_SIZE', 1000))
+    if export_format == 'csv':
+        field_names = [name for name in schema.declared_fields if name in schema.dump_fields]
+        content = _generate_csv(batches, field_names)
+    else:
+        content = _generate_ndjson(batches)
+
+    return Response(
+        stream_with_context(content),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}.{export_format}'}
+    )
@@ -0,0 +1,48 @@
+"""change feed
+
+Revision ID: 3850753116a9
+Revises: 9ad63ea640a2
+Create Date: 2026-10-18 11:48:05.127334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3850753116a9'
+down_revision = '9ad63ea640a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('authors', sa.Column('created_at', sa.DateTime(), nullable=False,
+                                       server_default=sa.func.now()))
+    op.add_column('books', sa.Column('created_at', sa.DateTime(), nullable=False,
+                                     server_default=sa.func.now()))
+    op.execute('UPDATE authors SET created_at = updated_at')
+    op.execute('UPDATE books SET created_at = updated_at')
+    op.create_index(op.f('ix_authors_updated_at'), 'authors', ['updated_at'], unique=False)
+    op.create_index(op.f('ix_books_updated_at'), 'books', ['updated_at'], unique=False)
+
+    op.create_table('deleted_records',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=50), nullable=False),
+    sa.Column('record_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_deleted_records_deleted_at_id', 'deleted_records', ['deleted_at', 'id'], unique=False)
+    op.create_index('ix_deleted_records_table_name_id', 'deleted_records', ['table_name', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_deleted_records_table_name_id', table_name='deleted_records')
+    op.drop_index('ix_deleted_records_deleted_at_id', table_name='deleted_records')
+    op.drop_table('deleted_records')
+
+    op.drop_index(op.f('ix_books_updated_at'), table_name='books')
+    op.drop_index(op.f('ix_authors_updated_at'), table_name='authors')
+    op.drop_column('books', 'created_at')
+    op.drop_column('authors', 'created_at')
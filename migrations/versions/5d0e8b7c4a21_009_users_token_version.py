@@ -0,0 +1,25 @@
+"""users token_version
+
+Revision ID: 5d0e8b7c4a21
+Revises: c3ea1565ce27
+Create Date: 2026-10-18 14:21:43.208316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d0e8b7c4a21'
+down_revision = 'c3ea1565ce27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('token_version', sa.Integer(), nullable=False,
+                                     server_default='0'))
+
+
+def downgrade():
+    op.drop_column('users', 'token_version')
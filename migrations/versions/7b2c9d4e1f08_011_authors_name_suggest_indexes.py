@@ -0,0 +1,36 @@
+"""authors name suggest indexes
+
+Revision ID: 7b2c9d4e1f08
+Revises: e41f7a92b6d3
+Create Date: 2026-10-18 15:47:09.652184
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2c9d4e1f08'
+down_revision = 'e41f7a92b6d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # other databases use the in-process prefix index (AUTHOR_SUGGEST_SOURCE)
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX ix_authors_first_name_lower ON authors (lower(first_name) text_pattern_ops)')
+    op.execute('CREATE INDEX ix_authors_last_name_lower ON authors (lower(last_name) text_pattern_ops)')
+    op.execute(
+        "CREATE INDEX ix_authors_full_name_trgm ON authors "
+        "USING GIN (lower(first_name || ' ' || last_name) gin_trgm_ops)"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_authors_full_name_trgm', table_name='authors')
+    op.drop_index('ix_authors_last_name_lower', table_name='authors')
+    op.drop_index('ix_authors_first_name_lower', table_name='authors')
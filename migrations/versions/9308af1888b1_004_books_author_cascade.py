@@ -0,0 +1,28 @@
+"""books author on delete cascade
+
+Revision ID: 9308af1888b1
+Revises: 28e7995f6800
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9308af1888b1'
+down_revision = '28e7995f6800'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_constraint('books_author_id_fkey', 'books', type_='foreignkey')
+    op.create_foreign_key('books_author_id_fkey', 'books', 'authors',
+                          ['author_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    op.drop_constraint('books_author_id_fkey', 'books', type_='foreignkey')
+    op.create_foreign_key('books_author_id_fkey', 'books', 'authors',
+                          ['author_id'], ['id'])
@@ -0,0 +1,28 @@
+"""books and authors updated_at
+
+Revision ID: 9ad63ea640a2
+Revises: 9308af1888b1
+Create Date: 2026-10-18 11:02:17.540931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9ad63ea640a2'
+down_revision = '9308af1888b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('authors', sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                       server_default=sa.func.now()))
+    op.add_column('books', sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                     server_default=sa.func.now()))
+
+
+def downgrade():
+    op.drop_column('books', 'updated_at')
+    op.drop_column('authors', 'updated_at')
@@ -0,0 +1,33 @@
+"""indexes for foreign key and filterable columns
+
+Revision ID: a6f3c1d85e47
+Revises: 7b2c9d4e1f08
+Create Date: 2026-10-18 16:24:38.901527
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6f3c1d85e47'
+down_revision = '7b2c9d4e1f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_books_author_id'), 'books', ['author_id'], unique=False)
+    op.create_index(op.f('ix_books_title'), 'books', ['title'], unique=False)
+    op.create_index(op.f('ix_books_number_of_pages'), 'books', ['number_of_pages'], unique=False)
+    op.create_index(op.f('ix_authors_first_name'), 'authors', ['first_name'], unique=False)
+    op.create_index(op.f('ix_authors_last_name'), 'authors', ['last_name'], unique=False)
+    op.create_index(op.f('ix_authors_birth_date'), 'authors', ['birth_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_authors_birth_date'), table_name='authors')
+    op.drop_index(op.f('ix_authors_last_name'), table_name='authors')
+    op.drop_index(op.f('ix_authors_first_name'), table_name='authors')
+    op.drop_index(op.f('ix_books_number_of_pages'), table_name='books')
+    op.drop_index(op.f('ix_books_title'), table_name='books')
+    op.drop_index(op.f('ix_books_author_id'), table_name='books')
@@ -0,0 +1,29 @@
+"""table write counters
+
+Revision ID: b7d4e2a9c135
+Revises: f2a8b3c6d914
+Create Date: 2026-10-18 19:12:44.306218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d4e2a9c135'
+down_revision = 'f2a8b3c6d914'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('table_versions',
+    sa.Column('table_name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    op.execute("INSERT INTO table_versions (table_name, version) VALUES ('authors', 0), ('books', 0)")
+
+
+def downgrade():
+    op.drop_table('table_versions')
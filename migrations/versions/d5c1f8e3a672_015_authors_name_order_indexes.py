@@ -0,0 +1,37 @@
+"""authors name indexes serving prefix ranges and ordering
+
+Revision ID: d5c1f8e3a672
+Revises: b7d4e2a9c135
+Create Date: 2026-10-18 19:48:31.774520
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5c1f8e3a672'
+down_revision = 'b7d4e2a9c135'
+branch_labels = None
+depends_on = None
+
+FULL_NAME = "first_name || ' ' || last_name"
+
+
+def upgrade():
+    # byte order ("C" collation) lets one index serve both the prefix range and ORDER BY
+    collation = ' COLLATE "C"' if op.get_bind().dialect.name == 'postgresql' else ''
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_authors_last_name_lower', table_name='authors')
+        op.drop_index('ix_authors_first_name_lower', table_name='authors')
+    op.execute(f'CREATE INDEX ix_authors_first_name_lower ON authors ((lower(first_name){collation}))')
+    op.execute(f'CREATE INDEX ix_authors_last_name_lower ON authors ((lower(last_name){collation}))')
+    op.execute(f'CREATE INDEX ix_authors_full_name_lower ON authors ((lower({FULL_NAME}){collation}))')
+
+
+def downgrade():
+    op.drop_index('ix_authors_full_name_lower', table_name='authors')
+    op.drop_index('ix_authors_last_name_lower', table_name='authors')
+    op.drop_index('ix_authors_first_name_lower', table_name='authors')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE INDEX ix_authors_first_name_lower ON authors (lower(first_name) text_pattern_ops)')
+        op.execute('CREATE INDEX ix_authors_last_name_lower ON authors (lower(last_name) text_pattern_ops)')
@@ -0,0 +1,59 @@
+"""books full text search
+
+Revision ID: e41f7a92b6d3
+Revises: 5d0e8b7c4a21
+Create Date: 2026-10-18 15:02:51.377019
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41f7a92b6d3'
+down_revision = '5d0e8b7c4a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute(
+            "ALTER TABLE books ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED"
+        )
+        op.execute('CREATE INDEX ix_books_search_vector ON books USING GIN (search_vector)')
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE books_search USING fts5("
+            "title, description, content='books', content_rowid='id', tokenize='porter unicode61')"
+        )
+        op.execute(
+            "CREATE TRIGGER books_search_ai AFTER INSERT ON books BEGIN "
+            "INSERT INTO books_search(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER books_search_ad AFTER DELETE ON books BEGIN "
+            "INSERT INTO books_search(books_search, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER books_search_au AFTER UPDATE ON books BEGIN "
+            "INSERT INTO books_search(books_search, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); "
+            "INSERT INTO books_search(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+        )
+        op.execute("INSERT INTO books_search(books_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_books_search_vector', table_name='books')
+        op.drop_column('books', 'search_vector')
+    elif dialect == 'sqlite':
+        op.execute('DROP TRIGGER books_search_au')
+        op.execute('DROP TRIGGER books_search_ad')
+        op.execute('DROP TRIGGER books_search_ai')
+        op.execute('DROP TABLE books_search')
@@ -1,4 +1,5 @@
 import pytest
+from sqlalchemy import event
 
 from library_app import create_app, db
 from library_app.commands.db_manage_commands import add_data
@@ -16,6 +17,21 @@ def app():
     app.config['DB_FILE_PATH'].unlink(missing_ok=True)
 
 
+@pytest.fixture
+def sql_statements(app):
+    statements = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+
+    event.listen(engine, 'before_cursor_execute', record_statement)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record_statement)
+
+
 @pytest.fixture
 def client(app):
     with app.test_client() as client:
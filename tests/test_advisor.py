@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from library_app import db
+from library_app.advisor import get_index_recommendations
+from library_app.commands.slow_query_commands import report
+
+
+@pytest.fixture
+def slow_query_log(app, tmp_path):
+    log_path = tmp_path / 'slow_queries.jsonl'
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = 0
+    app.config['SLOW_QUERY_LOG'] = str(log_path)
+    return log_path
+
+
+def test_slow_query_logged(client, sample_data, slow_query_log):
+    response = client.get('/api/v1/books?description=unknown&sort=-number_of_pages')
+    assert response.status_code == 200
+
+    entries = [json.loads(line) for line in slow_query_log.read_text().splitlines()]
+    assert entries
+    assert {entry['table'] for entry in entries} == {'books'}
+    assert entries[0]['endpoint'] == 'books.get_books'
+    assert entries[0]['filters'] == [['description', '==']]
+    assert entries[0]['sort'] == ['-number_of_pages']
+    assert entries[0]['plan']
+
+
+def test_slow_query_not_logged_without_threshold(app, client, sample_data, slow_query_log):
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = None
+    client.get('/api/v1/books?description=unknown')
+
+    assert not slow_query_log.exists()
+
+
+def test_slow_query_report(app, client, sample_data, slow_query_log):
+    client.get('/api/v1/books?description=unknown&number_of_pages[gte]=100&sort=-title')
+    client.get('/api/v1/authors?last_name=King')
+
+    result = app.test_cli_runner().invoke(report)
+
+    assert result.exit_code == 0
+    assert 'books: filters description[==], number_of_pages[gte]; sort -title' in result.output
+    assert 'covered by existing index on (number_of_pages)' in result.output
+    assert 'CREATE INDEX ix_books_description' not in result.output
+    assert 'not indexed (unbounded text): description' in result.output
+    assert 'authors: filters last_name[==]; sort -' in result.output
+    assert 'covered by existing index on (last_name)' in result.output
+
+
+def test_slow_query_report_empty(app, slow_query_log):
+    result = app.test_cli_runner().invoke(report)
+
+    assert result.exit_code == 0
+    assert 'No slow queries logged' in result.output
+
+
+def test_author_books_query_uses_index(app, sample_data):
+    with app.app_context():
+        plan = db.session.execute('EXPLAIN QUERY PLAN SELECT * FROM books WHERE author_id = 1').all()
+
+    assert any('ix_books_author_id' in row[-1] for row in plan)
+
+
+def test_index_recommendation_leaves_out_text_columns(app):
+    entry = {'table': 'books', 'filters': [['description', '==']], 'sort': ['-created_at'],
+             'duration_ms': 250.0, 'plan': []}
+    with app.app_context():
+        recommendation, = get_index_recommendations(db.engine, [entry])
+
+    assert recommendation['index'] == 'CREATE INDEX ix_books_created_at ON books (created_at)'
+    assert recommendation['excluded'] == ['description']
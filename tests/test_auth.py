@@ -1,4 +1,14 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import jwt
 import pytest
+from werkzeug.security import generate_password_hash
+
+from library_app import db
+from library_app.commands.password_hash_commands import calibrate
+from library_app.hashing import get_password_hasher
+from library_app.models import RevokedToken, User
 
 
 def test_registration(client):
@@ -169,3 +179,321 @@ def test_update_user_data(client, user, token):
     assert response_data['data']['email'] == 'test1@example.com'
     assert 'id' in response_data['data']
     assert 'creation_date' in response_data['data']
+
+
+def test_update_user_data_already_used_email(client, user, token):
+    client.post('/api/v1/auth/register',
+                json={
+                    'username': 'user1',
+                    'email': 'user1@example.com',
+                    'password': '123456'
+                })
+    response = client.put('/api/v1/auth/update/data',
+                          headers={
+                              'Authorization': f'Bearer {token}'
+                          },
+                          json={
+                              'email': 'user1@example.com',
+                              'username': user['username']
+                          })
+
+    response_data = response.get_json()
+    assert response.status_code == 409
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is False
+    assert response_data['message'] == 'User with email user1@example.com already exists'
+
+
+def test_get_current_user_after_update(client, user, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/api/v1/auth/me', headers=headers)
+    response = client.put('/api/v1/auth/update/data',
+                          headers=headers,
+                          json={
+                              'email': 'test1@example.com',
+                              'username': 'test1'
+                          })
+    new_token = response.get_json()['token']
+
+    response = client.get('/api/v1/auth/me', headers=headers)
+    assert response.status_code == 401
+    assert response.get_json()['message'] == 'Outdated token. Please login to get new token'
+
+    response = client.get('/api/v1/auth/me', headers={'Authorization': f'Bearer {new_token}'})
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['data']['username'] == 'test1'
+    assert response_data['data']['email'] == 'test1@example.com'
+
+
+def test_update_password_invalidates_token(client, user, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.put('/api/v1/auth/update/password',
+                          headers=headers,
+                          json={
+                              'current_password': user['password'],
+                              'new_password': 'qazwsx'
+                          })
+    new_token = response.get_json()['token']
+
+    assert client.get('/api/v1/auth/me', headers=headers).status_code == 401
+    response = client.get('/api/v1/auth/me', headers={'Authorization': f'Bearer {new_token}'})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('url, data', [
+    ('/api/v1/auth/update/password', {'current_password': 'test', 'new_password': 'qazwsx'}),
+    ('/api/v1/auth/update/data', {'username': 'test1', 'email': 'test1@example.com'})
+])
+def test_update_user_revokes_refresh_tokens(client, user, url, data):
+    response = client.post('/api/v1/auth/login',
+                           json={
+                               'username': user['username'],
+                               'password': user['password']
+                           })
+    response_data = response.get_json()
+    refresh_token = response_data['refresh_token']
+    if 'current_password' in data:
+        data = {**data, 'current_password': user['password']}
+
+    response = client.put(url, headers={'Authorization': f'Bearer {response_data["token"]}'}, json=data)
+    new_refresh_token = response.get_json()['refresh_token']
+
+    response = client.post('/api/v1/auth/refresh', json={'refresh_token': new_refresh_token})
+    assert response.status_code == 200
+    response = client.post('/api/v1/auth/refresh', json={'refresh_token': refresh_token})
+    assert response.status_code == 401
+
+
+def test_token_version_cache_timeout(app, client, user, token):
+    app.config['TOKEN_VERSION_CACHE_TIMEOUT'] = 0
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/v1/auth/me', headers=headers).status_code == 200
+
+    # a password change of another worker does not invalidate this process' entity cache
+    connection = sqlite3.connect(app.config['DB_FILE_PATH'])
+    connection.execute('UPDATE users SET token_version = token_version + 1')
+    connection.commit()
+    connection.close()
+
+    assert client.get('/api/v1/auth/me', headers=headers).status_code == 401
+
+
+def test_get_current_user_from_claims(client, user, token, sql_statements):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/api/v1/auth/me', headers=headers)
+    sql_statements.clear()
+
+    response = client.get('/api/v1/auth/me', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['data']['username'] == user['username']
+    assert not [statement for statement in sql_statements if 'FROM users' in statement]
+
+    response = client.get('/api/v1/auth/me?fresh=1', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['data']['username'] == user['username']
+    assert [statement for statement in sql_statements if 'FROM users' in statement]
+
+
+def test_refresh_token(client, user):
+    response = client.post('/api/v1/auth/login',
+                           json={
+                               'username': user['username'],
+                               'password': user['password']
+                           })
+    refresh_token = response.get_json()['refresh_token']
+
+    response = client.post('/api/v1/auth/refresh', json={'refresh_token': refresh_token})
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is True
+    assert response_data['refresh_token'] != refresh_token
+
+    response = client.get('/api/v1/auth/me',
+                          headers={
+                              'Authorization': f'Bearer {response_data["token"]}'
+                          })
+    assert response.status_code == 200
+    assert response.get_json()['data']['username'] == user['username']
+
+
+def test_refresh_token_keeps_cached_token_versions_of_other_users(app, client, user, token):
+    client.get('/api/v1/auth/me', headers={'Authorization': f'Bearer {token}'})
+    other_user = {'username': 'other', 'email': 'other@example.com', 'password': '123456'}
+    response = client.post('/api/v1/auth/register', json=other_user)
+
+    response = client.post('/api/v1/auth/refresh', json={'refresh_token': response.get_json()['refresh_token']})
+    assert response.status_code == 200
+
+    with app.app_context():
+        user_id = User.query.filter(User.username == user['username']).first().id
+    assert app.extensions['entity_cache'].get(('token_versions', user_id)) is not None
+
+
+def test_refresh_token_reuse_revokes_all_tokens(client, user):
+    response = client.post('/api/v1/auth/login',
+                           json={
+                               'username': user['username'],
+                               'password': user['password']
+                           })
+    refresh_token = response.get_json()['refresh_token']
+    response = client.post('/api/v1/auth/refresh', json={'refresh_token': refresh_token})
+    rotated_refresh_token = response.get_json()['refresh_token']
+
+    response = client.post('/api/v1/auth/refresh', json={'refresh_token': refresh_token})
+
+    response_data = response.get_json()
+    assert response.status_code == 401
+    assert response_data['success'] is False
+    assert 'token' not in response_data
+
+    response = client.post('/api/v1/auth/refresh', json={'refresh_token': rotated_refresh_token})
+    assert response.status_code == 401
+
+
+def test_refresh_token_invalid(client, user):
+    response = client.post('/api/v1/auth/refresh', json={'refresh_token': 'invalid'})
+
+    response_data = response.get_json()
+    assert response.status_code == 401
+    assert response_data['success'] is False
+
+
+def test_logout(client, user, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/api/v1/auth/logout', headers=headers)
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is True
+
+    response = client.get('/api/v1/auth/me', headers=headers)
+
+    response_data = response.get_json()
+    assert response.status_code == 401
+    assert response_data['success'] is False
+    assert response_data['message'] == 'Revoked token. Please login to get new token'
+
+
+def test_token_revoked_by_another_process(app, client, user, token):
+    app.config['REVOCATION_REFRESH_SECONDS'] = 0
+    payload = jwt.decode(token, options={'verify_signature': False})
+    with app.app_context():
+        db.session.add(RevokedToken(jti=payload['jti'], expires_at=datetime.utcfromtimestamp(payload['exp'])))
+        db.session.commit()
+
+    response = client.get('/api/v1/auth/me',
+                          headers={
+                              'Authorization': f'Bearer {token}'
+                          })
+
+    assert response.status_code == 401
+    assert response.get_json()['message'] == 'Revoked token. Please login to get new token'
+
+
+def test_token_revoked_by_transaction_committed_late(app, client, user, token):
+    app.config['REVOCATION_REFRESH_SECONDS'] = 0
+    app.config['REVOCATION_SETTLE_SECONDS'] = 5
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/v1/auth/me', headers=headers).status_code == 200
+
+    # revoked before the last refresh, but committed after it
+    payload = jwt.decode(token, options={'verify_signature': False})
+    with app.app_context():
+        db.session.add(RevokedToken(jti=payload['jti'], expires_at=datetime.utcfromtimestamp(payload['exp']),
+                                    revoked_at=datetime.utcnow() - timedelta(seconds=2)))
+        db.session.commit()
+
+    assert client.get('/api/v1/auth/me', headers=headers).status_code == 401
+
+
+def test_expired_revoked_tokens_pruned(app, client, user, token):
+    app.config['REVOCATION_REFRESH_SECONDS'] = 0
+    app.config['REVOCATION_PRUNE_SECONDS'] = 0
+    with app.app_context():
+        db.session.add(RevokedToken(jti='expired', expires_at=datetime.utcnow() - timedelta(minutes=1)))
+        db.session.add(RevokedToken(jti='active', expires_at=datetime.utcnow() + timedelta(minutes=1)))
+        db.session.commit()
+
+    assert client.get('/api/v1/auth/me', headers={'Authorization': f'Bearer {token}'}).status_code == 200
+
+    with app.app_context():
+        assert [jti for jti, in db.session.query(RevokedToken.jti)] == ['active']
+
+
+def test_login_rehashes_outdated_password(app, client, user):
+    with app.app_context():
+        stored_user = User.query.filter(User.username == user['username']).first()
+        stored_user.password = generate_password_hash(user['password'], 'pbkdf2:sha256:2000')
+        db.session.commit()
+
+    response = client.post('/api/v1/auth/login',
+                           json={
+                               'username': user['username'],
+                               'password': user['password']
+                           })
+    assert response.status_code == 200
+
+    with app.app_context():
+        stored_user = User.query.filter(User.username == user['username']).first()
+        assert stored_user.password.startswith('pbkdf2:sha256:1000$')
+        assert stored_user.is_password_valid(user['password'])
+
+
+def test_password_hash_calibrate(app):
+    runner = app.test_cli_runner()
+    result = runner.invoke(calibrate, ['--target-ms', '5'])
+
+    assert result.exit_code == 0
+    assert 'PASSWORD_HASH_ITERATIONS=' in result.output
+
+
+def test_login_rate_limited_per_username(app, client, user):
+    app.config['AUTH_RATE_LIMIT_PER_USERNAME'] = (2, 60)
+    credentials = {'username': user['username'], 'password': 'wrong-password'}
+
+    assert client.post('/api/v1/auth/login', json=credentials).status_code == 401
+    assert client.post('/api/v1/auth/login', json=credentials).status_code == 401
+    response = client.post('/api/v1/auth/login', json=credentials)
+
+    response_data = response.get_json()
+    assert response.status_code == 429
+    assert response.headers['Content-Type'] == 'application/json'
+    assert int(response.headers['Retry-After']) >= 1
+    assert response_data['success'] is False
+
+    response = client.post('/api/v1/auth/login', json={'username': 'other', 'password': '123456'})
+    assert response.status_code == 401
+
+
+def test_login_rate_limited_per_ip(app, client):
+    app.config['AUTH_RATE_LIMIT_PER_IP'] = (1, 60)
+
+    assert client.post('/api/v1/auth/login', json={'username': 'a', 'password': '123456'}).status_code == 401
+    response = client.post('/api/v1/auth/login', json={'username': 'b', 'password': '123456'})
+    assert response.status_code == 429
+
+
+def test_login_password_hashing_busy(app, client, user):
+    app.config['PASSWORD_HASH_MAX_CONCURRENT'] = 1
+    app.config['PASSWORD_HASH_WAIT_SECONDS'] = 0
+    app.extensions.pop('password_hasher', None)
+    with app.app_context():
+        password_hasher = get_password_hasher()
+    password_hasher._semaphore.acquire()
+
+    try:
+        response = client.post('/api/v1/auth/login',
+                               json={
+                                   'username': user['username'],
+                                   'password': user['password']
+                               })
+    finally:
+        password_hasher._semaphore.release()
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert response.get_json()['success'] is False
@@ -1,4 +1,10 @@
+import sqlite3
+
 import pytest
+from sqlalchemy import text
+
+from library_app import db
+from library_app.authors.authors import get_author_suggestions_query
 
 
 def test_authors_no_records(client):
@@ -63,6 +69,49 @@ def test_get_authors_with_params(client, sample_data):
     ]
 
 
+@pytest.mark.parametrize('limit', [2, 10])
+def test_get_authors_include_books_query_count(client, sample_data, sql_statements, limit):
+    response = client.get(f'/api/v1/authors?include=books&limit={limit}')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert all('books' in author for author in response_data['data'])
+    assert len(sql_statements) == 3
+
+
+def test_get_authors_without_include(client, sample_data):
+    response = client.get('/api/v1/authors?include=')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['number_of_records'] == 5
+    assert all('books' not in author for author in response_data['data'])
+
+
+def test_get_authors_cached(client, sample_data, token, author, sql_statements):
+    response = client.get('/api/v1/authors?sort=-id&limit=2')
+    assert response.status_code == 200
+    statements_count = len(sql_statements)
+
+    cached_response = client.get('/api/v1/authors?limit=2&sort=-id')
+    assert cached_response.status_code == 200
+    assert cached_response.get_json() == response.get_json()
+    assert len(sql_statements) == statements_count + 1
+    assert 'FROM table_versions' in sql_statements[-1]
+
+    client.post('/api/v1/authors',
+                json=author,
+                headers={
+                    'Authorization': f'Bearer {token}'
+                })
+    response = client.get('/api/v1/authors?sort=-id&limit=2')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['pagination']['total_records'] == 11
+    assert response_data['data'][0]['first_name'] == author['first_name']
+
+
 def test_get_single_author(client, sample_data):
     response = client.get('/api/v1/authors/3')
 
@@ -240,6 +289,37 @@ def test_update_author_not_found(client, token, author, sample_data):
     assert 'data' not in response_data
 
 
+def test_patch_author(client, token, sample_data):
+    response = client.patch('/api/v1/authors/5',
+                            json={'last_name': 'Bachman'},
+                            headers={
+                                'Authorization': f'Bearer {token}'
+                            })
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is True
+    assert response_data['data'] == {
+        'id': 5,
+        'first_name': 'Stephen',
+        'last_name': 'Bachman',
+        'birth_date': '21-09-1947'
+    }
+
+
+def test_patch_author_not_found(client, token, sample_data):
+    response = client.patch('/api/v1/authors/53',
+                            json={'last_name': 'Bachman'},
+                            headers={
+                                'Authorization': f'Bearer {token}'
+                            })
+
+    response_data = response.get_json()
+    assert response.status_code == 404
+    assert response_data['success'] is False
+
+
 def test_delete_author(client, sample_data, token):
     response = client.delete('/api/v1/authors/2',
                              headers={
@@ -261,6 +341,21 @@ def test_delete_author(client, sample_data, token):
     assert response_data['success'] is False
 
 
+def test_delete_author_cascades_books(client, sample_data, token, sql_statements):
+    response = client.delete('/api/v1/authors/6',
+                             headers={
+                                 'Authorization': f'Bearer {token}'
+                             })
+
+    assert response.status_code == 200
+    assert not any(statement.startswith('SELECT') and 'FROM books' in statement
+                   for statement in sql_statements)
+    assert not any('DELETE FROM books' in statement for statement in sql_statements)
+
+    response = client.get('/api/v1/books?author_id=6')
+    assert response.get_json()['pagination']['total_records'] == 0
+
+
 def test_delete_author_not_found(client, sample_data, token):
     response = client.delete('/api/v1/authors/78',
                              headers={
@@ -270,3 +365,110 @@ def test_delete_author_not_found(client, sample_data, token):
     assert response.status_code == 404
     assert response.headers['Content-Type'] == 'application/json'
     assert response_data['success'] is False
+
+
+@pytest.mark.parametrize('source', ['memory', 'database'])
+@pytest.mark.parametrize(
+    'q, expected_ids',
+    [
+        ('s', [8, 9, 5, 6]),
+        ('KI', [5]),
+        ('stephen k', [5]),
+        ('x', []),
+        ('%', [])
+    ]
+)
+def test_suggest_authors(app, client, sample_data, source, q, expected_ids):
+    app.config['AUTHOR_SUGGEST_SOURCE'] = source
+    if source == 'memory':
+        # the index is built in the background, requests go to the database meanwhile
+        client.get('/api/v1/authors/suggest?q=a')
+        app.extensions['prefix_index:authors'].wait()
+    response = client.get(f'/api/v1/authors/suggest?q={q}&limit=4')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is True
+    assert sorted(author['id'] for author in response_data['data']) == sorted(expected_ids)
+    assert all(set(author) == {'id', 'first_name', 'last_name'} for author in response_data['data'])
+
+
+def test_suggest_authors_after_create(client, sample_data, token, author):
+    response = client.get('/api/v1/authors/suggest?q=lat')
+    assert response.get_json()['data'] == []
+
+    client.post('/api/v1/authors',
+                json=author,
+                headers={
+                    'Authorization': f'Bearer {token}'
+                })
+    response = client.get('/api/v1/authors/suggest?q=lat')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert [suggestion['last_name'] for suggestion in response_data['data']] == ['latanski']
+
+
+def test_suggest_authors_index_rebuilt_in_background(app, client, sample_data, token, author):
+    client.get('/api/v1/authors/suggest?q=lat')
+    prefix_index = app.extensions['prefix_index:authors']
+    prefix_index.wait()
+    version = prefix_index.version
+
+    client.post('/api/v1/authors',
+                json=author,
+                headers={
+                    'Authorization': f'Bearer {token}'
+                })
+    response = client.get('/api/v1/authors/suggest?q=lat')
+    assert [suggestion['last_name'] for suggestion in response.get_json()['data']] == ['latanski']
+
+    prefix_index.wait()
+    assert prefix_index.version != version
+    assert [suggestion['last_name'] for suggestion in prefix_index.search('lat', 10)] == ['latanski']
+
+
+def test_suggest_authors_created_by_another_process(app, client, sample_data):
+    client.get('/api/v1/authors/suggest?q=lat')
+    app.extensions['prefix_index:authors'].wait()
+
+    connection = sqlite3.connect(app.config['DB_FILE_PATH'])
+    connection.execute("INSERT INTO authors (first_name, last_name, birth_date, created_at, updated_at) "
+                       "VALUES ('Jan', 'Latanski', '1990-01-01', '2100-01-01 00:00:00', '2100-01-01 00:00:00')")
+    connection.execute("UPDATE table_versions SET version = version + 1 WHERE table_name = 'authors'")
+    connection.commit()
+    connection.close()
+
+    response = client.get('/api/v1/authors/suggest?q=lat')
+    assert [suggestion['last_name'] for suggestion in response.get_json()['data']] == ['Latanski']
+
+
+@pytest.mark.parametrize('q', ['s', 'stephen k'])
+def test_suggest_authors_query_reads_name_indexes_in_order(app, sample_data, q):
+    with app.app_context():
+        statement = get_author_suggestions_query(q, 4).compile(db.engine, compile_kwargs={'literal_binds': True})
+        plan = [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {statement}'))]
+
+    for index in ('ix_authors_first_name_lower', 'ix_authors_last_name_lower', 'ix_authors_full_name_lower'):
+        assert any(step.startswith(f'SEARCH authors USING INDEX {index}') for step in plan)
+    assert not any('TEMP B-TREE' in step for step in plan)
+
+
+def test_suggest_authors_missing_query(client, sample_data):
+    response = client.get('/api/v1/authors/suggest')
+
+    response_data = response.get_json()
+    assert response.status_code == 400
+    assert response_data['success'] is False
+
+
+def test_get_authors_filter_birth_date(client, sample_data):
+    response = client.get('/api/v1/authors?birth_date[gte]=01-01-1950&sort=birth_date&fields=last_name&limit=10')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert [author['last_name'] for author in response_data['data']] == ['Tokarczuk', 'Collins', 'Sebold', 'Brown']
+
+    response = client.get('/api/v1/authors?birth_date[gte]=1950-01-01')
+    assert response.status_code == 400
@@ -1,5 +1,14 @@
+import csv
+import io
+import json
+import sqlite3
+
 import pytest
 
+from library_app import entity_cache
+from library_app.models import Book
+from library_app.query_spec import get_query_spec
+
 
 def test_get_books_no_records(client):
     response = client.get('/api/v1/books')
@@ -65,6 +74,131 @@ def test_get_books_with_params(client, sample_data):
     ]
 
 
+def test_get_books_with_cursor(client, sample_data):
+    response = client.get('/api/v1/books?sort=-number_of_pages&limit=100')
+    expected_titles = [book['title'] for book in response.get_json()['data']]
+
+    titles = []
+    next_url = '/api/v1/books?cursor=&sort=-number_of_pages&fields=title&limit=4'
+    while next_url:
+        response = client.get(next_url)
+        response_data = response.get_json()
+        assert response.status_code == 200
+        assert 'total_records' not in response_data['pagination']
+        titles.extend(book['title'] for book in response_data['data'])
+        next_url = response_data['pagination'].get('next_cursor')
+
+    assert titles == expected_titles
+
+    response = client.get(response_data['pagination']['prev_cursor'])
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert [book['title'] for book in response_data['data']] == expected_titles[8:12]
+    assert 'next_cursor' in response_data['pagination']
+
+
+@pytest.mark.parametrize('sort', ['description', '-description'])
+def test_get_books_with_cursor_nullable_sort_key(client, token, sample_data, sort):
+    books = [
+        {'title': f'No description {number}', 'isbn': 1234567890000 + number, 'number_of_pages': 100}
+        for number in range(3)
+    ]
+    client.post('/api/v1/authors/1/books/batch',
+                json=books,
+                headers={
+                    'Authorization': f'Bearer {token}'
+                })
+    response = client.get(f'/api/v1/books?sort={sort},id&fields=id&limit=100')
+    expected_ids = [item['id'] for item in response.get_json()['data']]
+
+    ids = []
+    next_url = f'/api/v1/books?cursor=&sort={sort}&fields=id&limit=2'
+    while next_url:
+        response = client.get(next_url)
+        response_data = response.get_json()
+        assert response.status_code == 200
+        ids.extend(item['id'] for item in response_data['data'])
+        next_url = response_data['pagination'].get('next_cursor')
+
+    assert ids == expected_ids
+    assert len(ids) == 17
+
+    response = client.get(response_data['pagination']['prev_cursor'])
+    assert response.status_code == 200
+    assert [item['id'] for item in response.get_json()['data']] == expected_ids[14:16]
+
+
+def test_get_books_with_invalid_cursor(client, sample_data):
+    response = client.get('/api/v1/books?cursor=invalid')
+
+    response_data = response.get_json()
+    assert response.status_code == 400
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is False
+    assert response_data['message'] == 'Invalid cursor'
+
+
+def test_get_books_include_author(client, sample_data):
+    response = client.get('/api/v1/books?include=author&limit=2')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['data'][0]['author'] == {
+        'id': 1,
+        'first_name': 'George',
+        'last_name': 'Orwell'
+    }
+
+    response = client.get('/api/v1/books?include=&limit=2')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert all('author' not in book for book in response_data['data'])
+
+
+def test_get_books_fields_projection(client, sample_data, sql_statements):
+    response = client.get('/api/v1/books?fields=title,isbn&sort=number_of_pages')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert set(response_data['data'][0]) == {'title', 'isbn'}
+    assert len(sql_statements) == 2
+    assert 'books.title' in sql_statements[1]
+    assert 'books.description' not in sql_statements[1]
+
+
+def test_export_books_ndjson(client, sample_data):
+    response = client.get('/api/v1/books/export?sort=-number_of_pages&number_of_pages[gte]=400')
+
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(records) == 7
+    assert all('author' in record for record in records)
+    assert [record['number_of_pages'] for record in records] == sorted(
+        [record['number_of_pages'] for record in records], reverse=True
+    )
+
+
+def test_export_books_csv(client, sample_data):
+    response = client.get('/api/v1/books/export?format=csv&fields=id,title')
+
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert len(rows) == 14
+    assert set(rows[0]) == {'id', 'title'}
+    assert rows[0]['title'] == 'Animal Farm'
+
+
+def test_export_books_invalid_format(client, sample_data):
+    response = client.get('/api/v1/books/export?format=xml')
+
+    response_data = response.get_json()
+    assert response.status_code == 400
+    assert response_data['success'] is False
+
+
 def test_get_single_book(client, sample_data):
     response = client.get('/api/v1/books/4')
 
@@ -83,6 +217,108 @@ def test_get_single_book(client, sample_data):
     assert response_data['data']['author'] == expected_author
 
 
+def test_get_single_book_warmed(app, client, sample_data):
+    app.config['ENTITY_CACHE_WARM_IDS'] = {'books': [1, 2]}
+    with app.app_context():
+        entity_cache.warm()
+
+    assert client.get('/api/v1/books/1').status_code == 200
+    assert client.get('/api/v1/books/2').status_code == 200
+    with app.app_context():
+        assert entity_cache.stats() == {'hits': 2, 'misses': 2, 'size': 2}
+
+
+def test_get_single_book_cached(app, client, sample_data, token, author):
+    client.get('/api/v1/books/4')
+    response = client.get('/api/v1/books/4')
+
+    assert response.status_code == 200
+    with app.app_context():
+        assert entity_cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    client.put('/api/v1/authors/3',
+               json=author,
+               headers={
+                   'Authorization': f'Bearer {token}'
+               })
+    response = client.get('/api/v1/books/4')
+
+    assert response.status_code == 200
+    assert response.get_json()['data']['author'] == {
+        'id': 3,
+        'first_name': author['first_name'],
+        'last_name': author['last_name']
+    }
+
+
+def test_get_single_book_changed_by_another_process(app, client, sample_data):
+    client.get('/api/v1/books/1')
+
+    # a write of another worker does not invalidate this process' entity cache
+    connection = sqlite3.connect(app.config['DB_FILE_PATH'])
+    connection.execute("UPDATE books SET title = 'Changed title', updated_at = '2100-01-01 00:00:00' WHERE id = 1")
+    connection.commit()
+    connection.close()
+
+    response = client.get('/api/v1/books/1')
+    assert response.status_code == 200
+    assert response.get_json()['data']['title'] == 'Changed title'
+
+    response = client.get('/api/v1/books/1', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_get_books_changed_by_another_process(app, client, sample_data):
+    client.get('/api/v1/books?fields=title&sort=id&limit=1')
+
+    # a worker with a clock behind this one commits a write, bumping the write counter like the app does
+    connection = sqlite3.connect(app.config['DB_FILE_PATH'])
+    connection.execute("UPDATE books SET title = 'Changed title', updated_at = '2000-01-01 00:00:00' WHERE id = 1")
+    connection.execute("UPDATE table_versions SET version = version + 1 WHERE table_name = 'books'")
+    connection.commit()
+    connection.close()
+
+    response = client.get('/api/v1/books?fields=title&sort=id&limit=1')
+    assert response.get_json()['data'] == [{'title': 'Changed title'}]
+
+
+def test_get_single_book_not_modified(client, sample_data, token):
+    response = client.get('/api/v1/books/4')
+    etag = response.headers['ETag']
+
+    response = client.get('/api/v1/books/4', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+    client.patch('/api/v1/books/4',
+                 json={'title': 'Matilda'},
+                 headers={
+                     'Authorization': f'Bearer {token}'
+                 })
+    response = client.get('/api/v1/books/4', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['data']['title'] == 'Matilda'
+
+
+def test_get_books_not_modified(client, sample_data, token):
+    response = client.get('/api/v1/books?sort=title')
+    etag = response.headers['ETag']
+
+    response = client.get('/api/v1/books?sort=title', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = client.get('/api/v1/books?sort=-title', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+    client.delete('/api/v1/books/14',
+                  headers={
+                      'Authorization': f'Bearer {token}'
+                  })
+    response = client.get('/api/v1/books?sort=title', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+
 def test_get_single_book_not_found(client, sample_data):
     response = client.get('/api/v1/books/43')
 
@@ -115,6 +351,33 @@ def test_update_book(client, sample_data, book_author_id, token):
     assert response_data['data']['author'] == expected_author
 
 
+def test_update_book_already_used_isbn(client, sample_data, book_author_id, token):
+    response = client.put('/api/v1/books/5',
+                          json={**book_author_id, 'isbn': 9780141036137},
+                          headers={
+                              'Authorization': f'Bearer {token}'
+                          })
+
+    response_data = response.get_json()
+    assert response.status_code == 409
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is False
+    assert response_data['message'] == 'Book with ISBN 9780141036137 already exists'
+
+
+def test_create_book_already_used_isbn(client, token, sample_data, book):
+    response = client.post('/api/v1/authors/1/books',
+                           json={**book, 'isbn': 9780141036137},
+                           headers={
+                               'Authorization': f'Bearer {token}'
+                           })
+
+    response_data = response.get_json()
+    assert response.status_code == 409
+    assert response_data['success'] is False
+    assert response_data['message'] == 'Book with ISBN 9780141036137 already exists'
+
+
 @pytest.mark.parametrize(
     'data, missing_field',
     [
@@ -305,3 +568,365 @@ def test_get_all_author_books_not_found(client, sample_data):
     assert response.headers['Content-Type'] == 'application/json'
     assert response_data['success'] is False
     assert 'data' not in response_data
+
+
+def test_get_books_out_of_range_page(client, sample_data):
+    response = client.get('/api/v1/books?page=4')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['data'] == []
+    assert response_data['pagination'] == {
+        'total_pages': 3,
+        'total_records': 14,
+        'current_page': '/api/v1/books?page=4',
+        'previous_page': '/api/v1/books?page=3'
+    }
+
+
+def test_get_books_without_count(client, sample_data):
+    response = client.get('/api/v1/books?count=none&page=3')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['number_of_records'] == 4
+    assert response_data['pagination'] == {
+        'has_next': False,
+        'current_page': '/api/v1/books?page=3&count=none',
+        'previous_page': '/api/v1/books?page=2&count=none'
+    }
+
+
+def test_get_books_with_estimated_count(client, sample_data):
+    response = client.get('/api/v1/books?count=estimate&number_of_pages[gte]=400')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['pagination'] == {
+        'total_pages': 2,
+        'total_records': 7,
+        'estimated': True,
+        'current_page': '/api/v1/books?page=1&count=estimate&number_of_pages%5Bgte%5D=400',
+        'next_page': '/api/v1/books?page=2&count=estimate&number_of_pages%5Bgte%5D=400'
+    }
+
+
+def test_get_books_invalid_count(client, sample_data):
+    response = client.get('/api/v1/books?count=all')
+
+    response_data = response.get_json()
+    assert response.status_code == 400
+    assert response_data['success'] is False
+
+
+def test_create_books_batch(client, token, sample_data, book):
+    books = [
+        book,
+        {**book, 'title': 'Animal Farm', 'isbn': 9780141036137},
+        {**book, 'title': 'TEST API 2', 'isbn': 1234567890001},
+        {**book, 'title': 'TEST API duplicate'},
+    ]
+    response = client.post('/api/v1/authors/1/books/batch',
+                           json=books,
+                           headers={
+                               'Authorization': f'Bearer {token}'
+                           })
+
+    response_data = response.get_json()
+    assert response.status_code == 201
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is True
+    assert response_data['number_of_records'] == 2
+    assert [result['success'] for result in response_data['data']] == [True, False, True, False]
+    assert response_data['data'][0]['id'] == 15
+    assert response_data['data'][2]['id'] == 16
+
+    response = client.get('/api/v1/books/16')
+    assert response.status_code == 200
+    assert response.get_json()['data']['title'] == 'TEST API 2'
+
+
+@pytest.mark.parametrize('described', [0, 1])
+def test_create_books_batch_mixed_description(client, token, sample_data, book, described):
+    books = [
+        {key: value for key, value in book.items() if key != 'description'},
+        {key: value for key, value in book.items() if key != 'description'}
+    ]
+    books[1]['isbn'] = 1234567890001
+    books[described]['description'] = 'Described book'
+    response = client.post('/api/v1/authors/1/books/batch',
+                           json=books,
+                           headers={
+                               'Authorization': f'Bearer {token}'
+                           })
+
+    response_data = response.get_json()
+    assert response.status_code == 201
+    descriptions = [
+        client.get(f'/api/v1/books/{result["id"]}').get_json()['data'].get('description')
+        for result in response_data['data']
+    ]
+    assert descriptions[described] == 'Described book'
+    assert descriptions[1 - described] is None
+
+
+def test_create_books_batch_all_conflicts(client, token, sample_data, book):
+    response = client.post('/api/v1/authors/1/books/batch',
+                           json=[{**book, 'isbn': 9780141036137}],
+                           headers={
+                               'Authorization': f'Bearer {token}'
+                           })
+
+    response_data = response.get_json()
+    assert response.status_code == 409
+    assert response_data['success'] is False
+    assert response_data['data'][0]['message'] == 'Book with ISBN 9780141036137 already exists'
+
+
+def test_create_books_batch_invalid_data(client, token, sample_data, book):
+    response = client.post('/api/v1/authors/1/books/batch',
+                           json=[book, {'title': 'Jas Fasola'}],
+                           headers={
+                               'Authorization': f'Bearer {token}'
+                           })
+
+    response_data = response.get_json()
+    assert response.status_code == 400
+    assert response_data['success'] is False
+    assert 'data' not in response_data
+
+
+def test_patch_book(client, sample_data, token, sql_statements):
+    response = client.patch('/api/v1/books/5',
+                            json={'title': 'Patched title'},
+                            headers={
+                                'Authorization': f'Bearer {token}'
+                            })
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is True
+    assert response_data['data']['id'] == 5
+    assert response_data['data']['title'] == 'Patched title'
+    assert not any(statement.startswith('SELECT') and 'authors' in statement for statement in sql_statements)
+
+    response = client.get('/api/v1/books/5')
+    assert response.get_json()['data']['title'] == 'Patched title'
+
+
+def test_patch_book_invalidates_changed_records_only(app, client, sample_data, token):
+    for url in ('/api/v1/books/1', '/api/v1/books/5', '/api/v1/authors/1', '/api/v1/authors/3', '/api/v1/authors/4'):
+        client.get(url)
+
+    response = client.patch('/api/v1/books/5',
+                            json={'author_id': 3},
+                            headers={
+                                'Authorization': f'Bearer {token}'
+                            })
+    assert response.status_code == 200
+
+    store = app.extensions['entity_cache']
+    assert store.get(('books', 1)) is not None
+    assert store.get(('authors', 1)) is not None
+    assert store.get(('books', 5)) is None
+    assert store.get(('authors', 3)) is None
+    assert store.get(('authors', 4)) is None
+    response = client.get('/api/v1/authors/3')
+    assert [book['id'] for book in response.get_json()['data']['books']] == [4, 5]
+
+
+def test_bulk_writes_invalidate_changed_records_only(app, client, sample_data, token, book):
+    for url in ('/api/v1/books/4', '/api/v1/authors/1', '/api/v1/authors/2', '/api/v1/authors/3'):
+        client.get(url)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    assert client.delete('/api/v1/books/1', headers=headers).status_code == 200
+    assert client.post('/api/v1/authors/2/books/batch', json=[book], headers=headers).status_code == 201
+
+    store = app.extensions['entity_cache']
+    assert store.get(('authors', 1)) is None
+    assert store.get(('authors', 2)) is None
+    assert store.get(('authors', 3)) is not None
+    assert store.get(('books', 4)) is not None
+
+
+def test_patch_book_already_used_isbn(client, sample_data, token):
+    response = client.patch('/api/v1/books/5',
+                            json={'isbn': 9780141036137},
+                            headers={
+                                'Authorization': f'Bearer {token}'
+                            })
+
+    response_data = response.get_json()
+    assert response.status_code == 409
+    assert response_data['success'] is False
+    assert response_data['message'] == 'Book with ISBN 9780141036137 already exists'
+
+
+def test_patch_book_not_found(client, sample_data, token):
+    response = client.patch('/api/v1/books/58',
+                            json={'title': 'Patched title'},
+                            headers={
+                                'Authorization': f'Bearer {token}'
+                            })
+
+    response_data = response.get_json()
+    assert response.status_code == 404
+    assert response_data['success'] is False
+
+
+def test_search_books(client, sample_data):
+    response = client.get('/api/v1/books/search?q=farms')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is True
+    assert [book['id'] for book in response_data['data']] == [1]
+    assert response_data['pagination']['total_records'] == 1
+
+
+def test_search_books_ranked_by_title(client, sample_data, token):
+    client.patch('/api/v1/books/5',
+                 json={'description': 'A story about a man and his farm'},
+                 headers={
+                     'Authorization': f'Bearer {token}'
+                 })
+
+    response = client.get('/api/v1/books/search?q=farm&fields=id,title')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['data'] == [{'id': 1, 'title': 'Animal Farm'}, {'id': 5, 'title': 'Timequake'}]
+
+
+def test_search_books_after_delete(client, sample_data, token):
+    client.delete('/api/v1/books/1',
+                  headers={
+                      'Authorization': f'Bearer {token}'
+                  })
+
+    response = client.get('/api/v1/books/search?q=farm')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['data'] == []
+
+
+def test_search_books_paginated(client, sample_data):
+    response = client.get('/api/v1/books/search?q=one&limit=1')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['number_of_records'] == 1
+    assert response_data['pagination']['total_records'] > 1
+    assert 'next_page' in response_data['pagination']
+
+
+@pytest.mark.parametrize('query_string', ['', 'q=', 'q=%20%20'])
+def test_search_books_missing_query(client, sample_data, query_string):
+    response = client.get(f'/api/v1/books/search?{query_string}')
+
+    response_data = response.get_json()
+    assert response.status_code == 400
+    assert response_data['success'] is False
+
+
+@pytest.mark.parametrize(
+    'query_string, message',
+    [
+        ('unknown=1', 'Unknown filter: unknown'),
+        ('title[like]=Inferno', 'Unknown filter: title[like]'),
+        ('additional_validation=1', 'Unknown filter: additional_validation'),
+        ('sort=-unknown', 'Unknown sort field: unknown'),
+        ('number_of_pages[gte]=many', 'Invalid value of filter number_of_pages[gte]: many')
+    ]
+)
+def test_get_books_invalid_query(client, sample_data, query_string, message):
+    response = client.get(f'/api/v1/books?{query_string}')
+
+    response_data = response.get_json()
+    assert response.status_code == 400
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is False
+    assert response_data['message'] == message
+
+
+def test_get_books_query_plan_cached(client, sample_data):
+    query_spec = get_query_spec(Book)
+
+    client.get('/api/v1/books?number_of_pages[gte]=400&title=Inferno&sort=-number_of_pages')
+    plan = query_spec.get_plan(('number_of_pages[gte]', 'title'), '-number_of_pages')
+    response = client.get('/api/v1/books?title=Inferno&number_of_pages[gte]=400&sort=-number_of_pages')
+
+    assert response.status_code == 200
+    assert [book['title'] for book in response.get_json()['data']] == ['Inferno']
+    assert query_spec.get_plan(('number_of_pages[gte]', 'title'), '-number_of_pages') is plan
+
+
+def test_get_books_in_filter(client, sample_data):
+    response = client.get('/api/v1/books?id[in]=3,1,99&sort=id&fields=id,title')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['data'] == [{'id': 1, 'title': 'Animal Farm'}, {'id': 3, 'title': 'Old Man and the Sea'}]
+
+    response = client.get('/api/v1/books?id[in]=1,x')
+    assert response.status_code == 400
+
+
+def test_get_books_by_ids(client, sample_data, sql_statements):
+    response = client.get('/api/v1/books?ids=3,99,1&fields=title')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data['success'] is True
+    assert response_data['number_of_records'] == 2
+    assert response_data['data'] == [
+        {'success': True, 'id': 3, 'data': {'title': 'Old Man and the Sea'}},
+        {'success': False, 'id': 99, 'message': 'Book with id: 99 not found'},
+        {'success': True, 'id': 1, 'data': {'title': 'Animal Farm'}}
+    ]
+    assert len([statement for statement in sql_statements if 'books.id IN' in statement]) == 1
+
+
+def test_get_books_by_isbns(client, sample_data):
+    response = client.get('/api/v1/books?isbns=9780679417392,9780141036137&include=author')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert [result['data']['title'] for result in response_data['data']] == ['1984', 'Animal Farm']
+    assert response_data['data'][0]['isbn'] == 9780679417392
+    assert response_data['data'][0]['data']['author']['last_name'] == 'Orwell'
+
+
+@pytest.mark.parametrize(
+    'query_string',
+    ['ids=1,a', 'ids=', f'ids={",".join(map(str, range(101)))}', 'ids=1&isbns=9780141036137', 'ids=1&title=1984']
+)
+def test_get_books_by_ids_invalid(client, sample_data, query_string):
+    response = client.get(f'/api/v1/books?{query_string}')
+
+    response_data = response.get_json()
+    assert response.status_code == 400
+    assert response_data['success'] is False
+
+
+def test_get_books_in_filter_with_estimated_count(client, sample_data):
+    response = client.get('/api/v1/books?id[in]=1,2,99&count=estimate')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['number_of_records'] == 2
+    assert response_data['pagination']['total_records'] == 2
+    assert response_data['pagination']['estimated'] is True
+
+
+def test_estimated_counts_cache_bounded(app, client, sample_data):
+    app.config['COUNT_ESTIMATE_MAX_SIZE'] = 2
+    for pages in (100, 200, 300):
+        client.get(f'/api/v1/books?count=estimate&number_of_pages[gte]={pages}')
+
+    assert len(app.extensions['count_estimates']._values) == 2
@@ -0,0 +1,49 @@
+import time
+
+from library_app.cache import VerifiedTokenCache, EntityStore
+from library_app.revocation import BloomFilter
+
+
+def test_verified_token_cache_respects_expiry(monkeypatch):
+    now = 1_700_000_000
+    monkeypatch.setattr(time, 'time', lambda: now + 0.5)
+    token_cache = VerifiedTokenCache(max_size=2)
+    token_cache.set('token', {'user_id': 1, 'exp': now + 1})
+
+    assert token_cache.get('token') == {'user_id': 1, 'exp': now + 1}
+
+    monkeypatch.setattr(time, 'time', lambda: now + 1)
+    assert token_cache.get('token') is None
+
+
+def test_verified_token_cache_evicts_least_recently_used():
+    exp = int(time.time()) + 60
+    token_cache = VerifiedTokenCache(max_size=2)
+    token_cache.set('first', {'user_id': 1, 'exp': exp})
+    token_cache.set('second', {'user_id': 2, 'exp': exp})
+    token_cache.get('first')
+    token_cache.set('third', {'user_id': 3, 'exp': exp})
+
+    assert token_cache.get('first') is not None
+    assert token_cache.get('second') is None
+    assert token_cache.get('third') is not None
+
+
+def test_entity_store_invalidates_dependents():
+    store = EntityStore(max_size=10, timeout=60)
+    store.set(('books', 1), {'id': 1}, related=[('authors', 1)])
+    store.set(('books', 2), {'id': 2}, related=[('authors', 2)])
+
+    store.invalidate(('authors', 1))
+
+    assert store.get(('books', 1)) is None
+    assert store.get(('books', 2)) == {'id': 2}
+    assert store.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(size=1024, hash_count=5)
+    bloom_filter.add('revoked')
+
+    assert 'revoked' in bloom_filter
+    assert 'not-revoked' not in bloom_filter
@@ -0,0 +1,70 @@
+import pytest
+
+
+def test_get_changes_no_records(client):
+    response = client.get('/api/v1/changes')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response_data == {
+        'success': True,
+        'data': [],
+        'number_of_records': 0,
+        'has_more': False,
+        'next_cursor': None
+    }
+
+
+def test_get_changes(client, sample_data, token):
+    response = client.get('/api/v1/changes?limit=20')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['number_of_records'] == 20
+    assert response_data['has_more'] is True
+    assert {change['type'] for change in response_data['data']} == {'created'}
+
+    response = client.get(f'/api/v1/changes?since={response_data["next_cursor"]}')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['number_of_records'] == 4
+    assert response_data['has_more'] is False
+    cursor = response_data['next_cursor']
+
+    headers = {'Authorization': f'Bearer {token}'}
+    client.patch('/api/v1/books/3', json={'title': 'Patched title'}, headers=headers)
+    client.delete('/api/v1/authors/6', headers=headers)
+    response = client.get(f'/api/v1/changes?since={cursor}')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert [(change['type'], change['resource']) for change in response_data['data']] == [
+        ('updated', 'books'),
+        ('deleted', 'books'),
+        ('deleted', 'books'),
+        ('deleted', 'books'),
+        ('deleted', 'authors'),
+    ]
+    assert response_data['data'][0]['data']['title'] == 'Patched title'
+    assert response_data['data'][-1]['id'] == 6
+
+
+def test_get_changes_invalid_cursor(client):
+    response = client.get('/api/v1/changes?since=invalid')
+
+    response_data = response.get_json()
+    assert response.status_code == 400
+    assert response_data['success'] is False
+
+
+@pytest.mark.parametrize('limit, expected_count', [(0, 1), (-5, 1), (10 ** 9, 24)])
+def test_get_changes_limit_clamped(app, client, sample_data, limit, expected_count):
+    app.config['CHANGES_MAX_PER_PAGE'] = 30
+    response = client.get(f'/api/v1/changes?limit={limit}')
+
+    response_data = response.get_json()
+    assert response.status_code == 200
+    assert response_data['number_of_records'] == expected_count
+    assert response_data['next_cursor'] is not None